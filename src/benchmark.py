@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the reference implementation of Pophery.
+
+Generates Pophery programs of adjustable size and shape, runs them, and
+reports how many steps per second they ran at and how much memory they
+used at most, optionally comparing the results against a stored baseline.
+
+"""
+
+
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from optparse import OptionParser
+
+from pophery import ENGINES, Semantics
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmark-baseline.json')
+
+WORKLOADS = {
+    'small': dict(length=2000),
+    'long-program': dict(length=20000),
+    'many-slots': dict(length=12000, slots=300),
+    'long-contents': dict(length=25000, content_length=2000),
+    'nested': dict(length=5000, nesting=20),
+    'noops': dict(length=10000, noop_fraction=0.9),
+    'name-slots': dict(length=5000, name_slots=True),
+}
+
+
+class NullOutput(object):
+    def write(self, string):
+        pass
+
+
+def generate(length=1000, slots=10, content_length=8, nesting=0,
+             noop_fraction=0.25, name_slots=False, seed=0):
+    """Return the text of a Pophery program about the given length.
+
+    The program has the given number of data slots.  The first ten are
+    named 0 to 9, and the code copies between these; the others, if
+    any, are only there to be searched through.  Each slot holds the
+    given number of characters, inside the given depth of nested
+    locators.  The code is a series of copies, outputs, and, in the
+    given proportion, characters which are not instructions.  If
+    name_slots is true, the accumulator and clipboard are reached
+    through name slots, and there are no outputs, as O always outputs
+    the slot named ?.
+
+    >>> print(generate(length=80, slots=2, content_length=3, nesting=1))
+    (^?)(?$)(^%)(%$)(^0)(^0.1)myn(0.1$)(0$)(^1)(^1.1)biq(1.1$)(1$)(^!)1(!$)SC1SV0SC0SV1SC0SV
+    >>> print(generate(length=60, slots=1, content_length=1, name_slots=True))
+    (^`?)a(`?$)(^a)(a$)(^`%)c(`%$)(^c)(c$)(^0)m(0$)(^!)0(!$)SC0SV0SC0SV0SC0SV
+    >>> p = Semantics(generate(length=500, slots=3))
+    >>> p.output = NullOutput()
+    >>> p.run()
+    RunResult('halted', steps=437)
+
+    """
+    rand = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    if name_slots:
+        parts = ['(^`?)a(`?$)(^a)(a$)(^`%)c(`%$)(^c)(c$)']
+    else:
+        parts = ['(^?)(?$)(^%)(%$)']
+    for slot in range(slots):
+        name = str(slot) if slot < 10 else 's%d' % slot
+        contents = ''.join(rand.choice(letters) for i in range(content_length))
+        for level in range(nesting, 0, -1):
+            contents = '(^%s.%d)%s(%s.%d$)' % (name, level, contents, name, level)
+        parts.append('(^%s)%s(%s$)' % (name, contents, name))
+    header = ''.join(parts)
+    names = [str(slot) for slot in range(min(slots, 10))]
+    code = []
+    size = len(header)
+    while size < length or not code:
+        if rand.random() < noop_fraction:
+            chunk = rand.choice(letters)
+        elif rand.random() < 0.2 and not name_slots:
+            chunk = rand.choice(names) + 'SO'
+        else:
+            chunk = (rand.choice(names) + 'SC' + rand.choice(names) + 'SV')
+        code.append(chunk)
+        size += len(chunk)
+    code = ''.join(code)
+    return header + '(^!)' + code[:1] + '(!$)' + code[1:]
+
+
+def measure(text, engine='string', fast_forward=False):
+    """Run the given program twice, once to time it, and once to measure
+    the memory it uses, and return a dictionary of the results.
+
+    """
+    program = Semantics(text, engine=engine)
+    program.output = NullOutput()
+    program.fast_forward = fast_forward
+    started = time.perf_counter()
+    result = program.run()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        program = Semantics(text, engine=engine)
+        program.output = NullOutput()
+        program.fast_forward = fast_forward
+        program.run()
+        (current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'length': len(text),
+        'steps': result.steps,
+        'seconds': elapsed,
+        'steps_per_second': result.steps / max(elapsed, 1e-9),
+        'peak_memory': peak,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of lines comparing the given results against the
+    given baseline, and the number of those which regressed by more than
+    the given tolerance (a fraction).
+
+    >>> lines, regressions = compare(
+    ...     {'a': {'steps_per_second': 50.0, 'peak_memory': 100}},
+    ...     {'a': {'steps_per_second': 100.0, 'peak_memory': 100}}, 0.25)
+    >>> print(lines[0])
+    a                        50 steps/s (0.50x)          100 bytes (1.00x)  REGRESSED
+    >>> regressions
+    1
+
+    """
+    lines = []
+    regressions = 0
+    for name in sorted(results):
+        result = results[name]
+        base = baseline.get(name)
+        if base is None:
+            lines.append("%-16s %10.0f steps/s %20d bytes  (no baseline)" %
+                         (name, result['steps_per_second'], result['peak_memory']))
+            continue
+        speed = result['steps_per_second'] / base['steps_per_second']
+        memory = float(result['peak_memory']) / max(base['peak_memory'], 1)
+        regressed = speed < 1 - tolerance or memory > 1 + tolerance
+        if regressed:
+            regressions += 1
+        lines.append("%-16s %10.0f steps/s (%.2fx) %12d bytes (%.2fx)%s" %
+                     (name, result['steps_per_second'], speed,
+                      result['peak_memory'], memory,
+                      "  REGRESSED" if regressed else ""))
+    return (lines, regressions)
+
+
+def main(argv):
+    optparser = OptionParser("[python] %prog {options} {workload}\n" + __doc__)
+    optparser.add_option("-b", "--baseline",
+                         action="store", type="string", dest="baseline",
+                         default=BASELINE,
+                         help="file to compare results against, or save them "
+                              "to (default: %s)" % BASELINE)
+    optparser.add_option("-E", "--engine",
+                         action="store", type="choice", dest="engine",
+                         choices=sorted(ENGINES.keys()), default='string',
+                         help="backing store to keep the programs in "
+                              "(one of: %s; default: string)" %
+                              ", ".join(sorted(ENGINES.keys())))
+    optparser.add_option("-f", "--fast-forward",
+                         action="store_true", dest="fast_forward", default=False,
+                         help="run the programs with fast-forwarding")
+    optparser.add_option("-s", "--save-baseline",
+                         action="store_true", dest="save_baseline", default=False,
+                         help="save the results as the baseline for this engine")
+    optparser.add_option("--tolerance",
+                         action="store", type="float", dest="tolerance", default=0.25,
+                         help="fraction by which a result may be worse than "
+                              "the baseline before it counts as a regression "
+                              "(default: 0.25)")
+    optparser.add_option("-T", "--run-tests",
+                         action="store_true", dest="run_tests", default=False,
+                         help="run self-tests and exit")
+    (options, args) = optparser.parse_args(argv[1:])
+
+    if options.run_tests:
+        import doctest
+        (fails, something) = doctest.testmod(verbose=True)
+        if fails == 0:
+            print("All tests passed.")
+            sys.exit(0)
+        sys.exit(1)
+
+    names = args or sorted(WORKLOADS.keys())
+    for name in names:
+        if name not in WORKLOADS:
+            optparser.error("unknown workload: %s (known: %s)" %
+                            (name, ", ".join(sorted(WORKLOADS.keys()))))
+
+    results = {}
+    for name in names:
+        results[name] = measure(generate(**WORKLOADS[name]),
+                                engine=options.engine,
+                                fast_forward=options.fast_forward)
+
+    key = options.engine
+    if options.fast_forward:
+        key += '+fast-forward'
+    baselines = {}
+    if os.path.exists(options.baseline):
+        file = open(options.baseline, 'r')
+        try:
+            baselines = json.load(file)
+        finally:
+            file.close()
+
+    (lines, regressions) = compare(results, baselines.get(key, {}),
+                                   options.tolerance)
+    for line in lines:
+        print(line)
+
+    if options.save_baseline:
+        baselines.setdefault(key, {}).update(results)
+        file = open(options.baseline, 'w')
+        try:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+            file.write("\n")
+        finally:
+            file.close()
+    elif regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Fuzzer for the engines of the reference implementation of Pophery.
+
+Generates random Pophery programs and runs each of them in lockstep in
+every engine, with and without fast-forwarding, against a plain string,
+reporting (and shrinking) any program on which they diverge.
+
+"""
+
+
+import random
+import sys
+from optparse import OptionParser
+
+from pophery import ENGINES, lockstep
+
+
+INSTRUCTIONS = list('0123XCVSALREFDOI')
+NOOPS = list('abxyz ')
+LOCATORS = ['(^t)', '(t$)', '(^`!)t(`!$)', '(^0)', '(0$)', '(^/)', '(/$)']
+# Stray parentheses, and halves of locators, which leave the parentheses
+# in the program unbalanced.
+UNBALANCED = ['(', ')', '(^t', 't$)', '(^/', '/$)']
+
+
+def random_program(rand, size=40):
+    """Return a random Pophery program, as a list of tokens, each of which
+    is a character or a locator, whose code has about the given number of
+    tokens.
+
+    >>> print(''.join(random_program(random.Random(1), size=10)))
+    (^?)hi(?$)(^%)i(%$)(^0)z(0$)(^1)(1$)(^2)ay(2$)(^!)y(!$)b0(^0)0xb3(^t)0
+    >>> print(''.join(random_program(random.Random(0), size=10)))
+    (^?)hi(?$)(^%)i(%$)(^0)yax(0$)(^1)yxy(1$)(^2)zb(2$)(^!)L(!$)3x(^/(^/(^`!)t(`!$)2(^/)3R
+
+    """
+    tokens = ['(^?)', 'hi', '(?$)', '(^%)', 'i', '(%$)']
+    for name in '012':
+        tokens.append('(^%s)' % name)
+        tokens.append(''.join(rand.choice(NOOPS) for i in range(rand.randint(0, 3))))
+        tokens.append('(%s$)' % name)
+    code = []
+    for i in range(size):
+        r = rand.random()
+        if r < 0.6:
+            code.append(rand.choice(INSTRUCTIONS))
+        elif r < 0.85:
+            code.append(rand.choice(NOOPS))
+        elif r < 0.95:
+            code.append(rand.choice(LOCATORS))
+        else:
+            code.append(rand.choice(UNBALANCED))
+    return tokens + ['(^!)'] + code[:1] + ['(!$)'] + code[1:]
+
+
+def diverges(text, max_steps=200, max_length=20000):
+    """Return a list of (engine, fast_forward, Divergence) triples, one
+    for each configuration in which the given program diverges from the
+    reference.
+
+    >>> diverges("(^?)Hi(?$)(^!)O(!$)")
+    []
+
+    """
+    found = []
+    for engine in sorted(ENGINES.keys()):
+        for fast_forward in (False, True):
+            divergence = lockstep(text, engine=engine, fast_forward=fast_forward,
+                                  max_steps=max_steps, max_length=max_length,
+                                  input=u"one\ntwo\n")
+            if divergence is not None:
+                found.append((engine, fast_forward, divergence))
+    return found
+
+
+def shrink(tokens, failing):
+    """Return a shortest list of tokens, found by removing tokens from the
+    given list one or more at a time, for which failing() is still true.
+
+    >>> shrink(list("xaxbxcx"), lambda tokens: 'b' in tokens and 'c' in tokens)
+    ['b', 'c']
+
+    """
+    chunk = len(tokens) // 2
+    while chunk >= 1:
+        pos = 0
+        while pos < len(tokens):
+            candidate = tokens[:pos] + tokens[pos + chunk:]
+            if failing(candidate):
+                tokens = candidate
+            else:
+                pos += chunk
+        chunk //= 2
+    return tokens
+
+
+def main(argv):
+    optparser = OptionParser("[python] %prog {options}\n" + __doc__)
+    optparser.add_option("-c", "--count",
+                         action="store", type="int", dest="count", default=200,
+                         help="number of programs to try (default: 200)")
+    optparser.add_option("-m", "--max-steps",
+                         action="store", type="int", dest="max_steps", default=200,
+                         help="steps to run each program for at most (default: 200)")
+    optparser.add_option("-s", "--seed",
+                         action="store", type="int", dest="seed", default=0,
+                         help="seed for the random programs (default: 0)")
+    optparser.add_option("-z", "--size",
+                         action="store", type="int", dest="size", default=40,
+                         help="number of tokens of code in each program (default: 40)")
+    optparser.add_option("-T", "--run-tests",
+                         action="store_true", dest="run_tests", default=False,
+                         help="run self-tests and exit")
+    (options, args) = optparser.parse_args(argv[1:])
+
+    if options.run_tests:
+        import doctest
+        (fails, something) = doctest.testmod(verbose=True)
+        if fails == 0:
+            print("All tests passed.")
+            sys.exit(0)
+        sys.exit(1)
+
+    rand = random.Random(options.seed)
+    failures = 0
+    for i in range(options.count):
+        tokens = random_program(rand, size=options.size)
+        found = diverges(''.join(tokens), max_steps=options.max_steps)
+        if not found:
+            continue
+        failures += 1
+        (engine, fast_forward, divergence) = found[0]
+
+        def failing(tokens):
+            divergence = lockstep(''.join(tokens), engine=engine,
+                                  fast_forward=fast_forward,
+                                  max_steps=options.max_steps, max_length=20000,
+                                  input=u"one\ntwo\n")
+            return divergence is not None
+
+        print("program %d diverges in %s:" % (
+            i, ", ".join(["%s%s" % (e, "+fast-forward" if f else "")
+                          for (e, f, d) in found])))
+        print("  %s" % ''.join(shrink(tokens, failing)))
+        print("  %s" % str(divergence).replace("\n", "\n  "))
+    print("%d of %d programs diverged" % (failures, options.count))
+    if failures > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
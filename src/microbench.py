@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the primitives of MutableString and SlottedString.
+
+Times each primitive on strings of increasing size, in each backing
+store, and fits the times to a power of the size, so that the backing
+stores can be compared primitive by primitive.
+
+"""
+
+
+import json
+import math
+import sys
+import time
+from optparse import OptionParser
+
+from pophery import ENGINES, SlottedString
+
+
+SIZES = (1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def fixture(size, engine, indexed=True):
+    """Return a SlottedString of about the given size, containing a slot
+    named a and a locator (*) in its middle, and one slot for about
+    every 60 characters besides.
+
+    >>> s = fixture(200, 'string')
+    >>> print(s.read_slot('a'), len(s), s.find("(*)") > 100)
+    xyz 241 True
+
+    """
+    parts = []
+    length = 0
+    count = 0
+    while length < size // 2:
+        part = (u"abcdefghijklmnopqrstuvwxyzabcdefghijklmn(^k%d)opqrst(k%d$)" %
+                (count, count))
+        parts.append(part)
+        length += len(part)
+        count += 1
+    left = u''.join(parts)
+    right = left.replace(u"(^k", u"(^j").replace(u"(k", u"(j")
+    return SlottedString(left + u"(^a)xyz(a$)uv(*)w" + right,
+                         engine=engine, indexed=indexed)
+
+
+def bench_pos_left(s, repeat):
+    for i in range(repeat):
+        s.pos_left(u"(^a)", 0)
+
+
+def bench_insert_locator(s, repeat):
+    pos = len(s) // 2
+    started = time.perf_counter()
+    for i in range(repeat):
+        s.insert_locator(u"(+%d)" % i, pos)
+    elapsed = time.perf_counter() - started
+    for i in range(repeat):
+        s.remove_locator(u"(+%d)" % i)
+    return elapsed
+
+
+def bench_remove_locator(s, repeat):
+    pos = len(s) // 2
+    for i in range(repeat):
+        s.insert_locator(u"(+%d)" % i, pos)
+    started = time.perf_counter()
+    for i in range(repeat):
+        s.remove_locator(u"(+%d)" % i)
+    return time.perf_counter() - started
+
+
+def bench_move_locator(s, repeat):
+    for i in range(repeat):
+        s.move_locator(u"(*)", 1 - 2 * (i % 2))
+
+
+def bench_slide_locator(s, repeat):
+    for i in range(repeat):
+        s.slide_locator(u"(*)", 1 - 2 * (i % 2))
+
+
+def bench_find_matching(s, repeat):
+    pos = s.find(u"(^a)")
+    for i in range(repeat):
+        s.find_matching(pos)
+
+
+def bench_read(s, repeat):
+    for i in range(repeat):
+        s.read(u"(^a)", u"(a$)")
+
+
+def bench_update(s, repeat):
+    for i in range(repeat):
+        s.update(u"(^a)", u"(a$)", u"xyz")
+
+
+def bench_strip_all_locators(s, repeat):
+    content = str(s)
+    for i in range(repeat):
+        s.strip_all_locators(content)
+
+
+PRIMITIVES = {
+    'pos_left': bench_pos_left,
+    'insert_locator': bench_insert_locator,
+    'remove_locator': bench_remove_locator,
+    'move_locator': bench_move_locator,
+    'slide_locator': bench_slide_locator,
+    'find_matching': bench_find_matching,
+    'read': bench_read,
+    'update': bench_update,
+    'strip_all_locators': bench_strip_all_locators,
+}
+
+
+def time_primitive(name, size, engine, indexed=True, repeat=100, trials=3):
+    """Return the least time, over the given number of trials, taken by
+    one call of the named primitive on a fixture of the given size.
+
+    """
+    best = None
+    for trial in range(trials):
+        s = fixture(size, engine, indexed=indexed)
+        started = time.perf_counter()
+        elapsed = PRIMITIVES[name](s, repeat)
+        if elapsed is None:
+            elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best / repeat
+
+
+def fit_exponent(sizes, times):
+    """Return the exponent k for which the given times best fit c * n**k
+    over the given sizes, by least squares on their logarithms.
+
+    >>> round(fit_exponent([10, 100, 1000], [3.0, 30.0, 300.0]), 3)
+    1.0
+    >>> round(fit_exponent([10, 100, 1000], [1.0, 1.0, 1.0]), 3)
+    0.0
+
+    """
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, 1e-12)) for t in times]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    num = sum((x - mx) * (y - my) for (x, y) in zip(xs, ys))
+    den = sum((x - mx) ** 2 for x in xs)
+    return num / den
+
+
+def classify(exponent):
+    """Return the complexity class nearest the given fitted exponent.
+
+    >>> [classify(k) for k in (0.1, 0.4, 0.95, 1.5, 2.2)]
+    ['O(1)', 'O(n^0.4)', 'O(n)', 'O(n^1.5)', 'O(n^2)']
+
+    """
+    for (k, name) in ((0, 'O(1)'), (1, 'O(n)'), (2, 'O(n^2)')):
+        if abs(exponent - k) < 0.25:
+            return name
+    return 'O(n^%.1f)' % exponent
+
+
+def main(argv):
+    optparser = OptionParser("[python] %prog {options} {primitive}\n" + __doc__)
+    optparser.add_option("-E", "--engine",
+                         action="append", type="choice", dest="engines",
+                         choices=sorted(ENGINES.keys()), default=None,
+                         help="backing store to benchmark; may be given more "
+                              "than once (default: all of %s)" %
+                              ", ".join(sorted(ENGINES.keys())))
+    optparser.add_option("-j", "--json",
+                         action="store_true", dest="json", default=False,
+                         help="print the results as JSON")
+    optparser.add_option("-r", "--repeat",
+                         action="store", type="int", dest="repeat", default=100,
+                         help="number of calls to time at each size (default: 100)")
+    optparser.add_option("-s", "--sizes",
+                         action="store", type="string", dest="sizes",
+                         default=",".join([str(n) for n in SIZES]),
+                         help="comma-separated sizes of string to time the "
+                              "primitives on (default: %s)" %
+                              ",".join([str(n) for n in SIZES]))
+    optparser.add_option("-u", "--unindexed",
+                         action="store_true", dest="unindexed", default=False,
+                         help="benchmark MutableStrings without a locator index")
+    optparser.add_option("-T", "--run-tests",
+                         action="store_true", dest="run_tests", default=False,
+                         help="run self-tests and exit")
+    (options, args) = optparser.parse_args(argv[1:])
+
+    if options.run_tests:
+        import doctest
+        (fails, something) = doctest.testmod(verbose=True)
+        if fails == 0:
+            print("All tests passed.")
+            sys.exit(0)
+        sys.exit(1)
+
+    names = args or sorted(PRIMITIVES.keys())
+    for name in names:
+        if name not in PRIMITIVES:
+            optparser.error("unknown primitive: %s (known: %s)" %
+                            (name, ", ".join(sorted(PRIMITIVES.keys()))))
+    engines = options.engines or sorted(ENGINES.keys())
+    sizes = [int(size) for size in options.sizes.split(',')]
+
+    results = []
+    for name in names:
+        for engine in engines:
+            times = [time_primitive(name, size, engine,
+                                    indexed=not options.unindexed,
+                                    repeat=options.repeat)
+                     for size in sizes]
+            exponent = fit_exponent(sizes, times)
+            results.append({
+                'primitive': name,
+                'engine': engine,
+                'sizes': sizes,
+                'times': times,
+                'exponent': exponent,
+                'class': classify(exponent),
+            })
+            if not options.json:
+                print("%-20s %-8s %-10s k=%5.2f  %10.2f us at n=%d" %
+                      (name, engine, classify(exponent), exponent,
+                       times[-1] * 1e6, sizes[-1]))
+                sys.stdout.flush()
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -19,120 +19,145 @@ from pophery import Program
 
 
 class Semantics(Program):
-    def execute(self, instruction):
-        """Apply the semantics of the given instruction to this Program.
-
-        >>> p = Semantics("(^?)(?$)")
-        >>> p.execute('0')
-        >>> print str(p)
-        (^?)0(?$)
-
-        >>> p = Semantics("(^@)(@$)")
-        >>> p.execute('@')
-        >>> print str(p)
-        (^@)@(@$)
-        >>> p = Semantics("(^`@)Jim(`@$)(^Jim)?(Jim$)")
-        >>> p.execute('@')
-        >>> print str(p)
-        (^`@)Jim(`@$)(^Jim)Jim(Jim$)
-
-        >>> p = Semantics("(^?)(?$)(^@)0(@$)(^0)Seven(0$)")
-        >>> p.execute('G')
-        >>> print str(p)
-        (^?)Seven(?$)(^@)0(@$)(^0)Seven(0$)
-
-        >>> p = Semantics("(^?)Meerkat(?$)(^@)0(@$)(^0)Seven(0$)")
-        >>> p.execute('P')
-        >>> print str(p)
-        (^?)Meerkat(?$)(^@)0(@$)(^0)Meerkat(0$)
-
-        >>> p = Semantics("(^?)!(?$)(^@)0(@$)(^0)Fenesrate(0$)")
-        >>> p.execute('A')
-        >>> print str(p)
-        (^?)!(?$)(^@)0(@$)(^0)!Fenesrate(0$)
-        >>> p.execute('Z')
-        >>> print str(p)
-        (^?)!(?$)(^@)0(@$)(^0)!Fenesrate!(0$)
-
-        >>> p = Semantics("(^@)0(@$)(^0)Seven(0$)")
-        >>> p.execute('X')
-        >>> print str(p)
-        (^@)0(@$)(^0)(0$)
-
-        >>> p = Semantics("(^@)0(@$)(^0)Licorice(0$)(^%)(%$)")
-        >>> p.execute('C')
-        >>> print str(p)
-        (^@)0(@$)(^0)Licorice(0$)(^%)Licorice(%$)
-
-        >>> p = Semantics("(^@)0(@$)(^0)Rock(0$)(^%)well(%$)")
-        >>> p.execute('V')
-        >>> print str(p)
-        (^@)0(@$)(^0)Rockwell(0$)(^%)well(%$)
-
-        >>> p = Semantics("(^@)0(@$)(^0)Rock(0$)(^%)well(%$)")
-        >>> p.execute('V')
-        >>> print str(p)
-        (^@)0(@$)(^0)Rockwell(0$)(^%)well(%$)
-
-        >>> p = Semantics("(^?)Hello, world!(?$)")
-        >>> p.execute('O')
-        Hello, world!
-        >>> print str(p)
-        (^?)Hello, world!(?$)
-
-        >>> from StringIO import StringIO
-        >>> p = Semantics("(^?)(?$)")
-        >>> p.input = StringIO(chr(10).join(["Line.", "Line!", "LINE!"]))
-        >>> p.execute('I')
-        >>> print str(p)
-        (^?)Line.(?$)
-        >>> p.execute('I')
-        >>> print str(p)
-        (^?)Line!(?$)
-        >>> p.execute('I')
-        >>> print str(p)
-        (^?)LINE!(?$)
-        >>> p.execute('I')
-        >>> print str(p)
-        (^?)(?$)
-
-        """
-        if instruction >= '0' and instruction <= '9':
-            self.update_slot(self.get_slot_name('?'), instruction)
-        elif instruction == '@':
-            self.update_slot(self.get_slot_name('@'), self.get_slot_name('@'))
-        elif instruction == 'G':
-            self.update_slot(self.get_slot_name('?'), self.read_slot_indirect(self.get_slot_name('@')))
-        elif instruction == 'P':
-            self.update_slot_indirect(self.get_slot_name('@'), self.read_slot('?'))
-        elif instruction == 'A':
-            value = self.read_slot('?') + self.read_slot_indirect(self.get_slot_name('@'))
-            self.update_slot_indirect(self.get_slot_name('@'), value)
-        elif instruction == 'Z':
-            value = self.read_slot_indirect(self.get_slot_name('@')) + self.read_slot('?') 
-            self.update_slot_indirect(self.get_slot_name('@'), value)
-        elif instruction == 'X':
-            self.update_slot_indirect(self.get_slot_name('@'), '')
-        elif instruction == 'C':
-            self.update_slot(self.get_slot_name('%'), self.read_slot_indirect(self.get_slot_name('@')))
-        elif instruction == 'V':
-            value = self.read_slot_indirect(self.get_slot_name('@')) + self.read_slot('%')
-            self.update_slot_indirect(self.get_slot_name('@'), value)
-        elif instruction == 'O':
-            line = self.read_slot('?') + "\n"
-            try:
-                self.output.write(line)
-            except UnicodeEncodeError:
-                self.output.write(line.encode('ascii', 'xmlcharrefreplace'))
-        elif instruction == 'I':
-            text = self.input.readline()
-            if text.endswith('\n'):
-                text = text[:-1]
-            self.update_slot(self.get_slot_name('?'), text)
-        else:
-            pass
-
-    def step(self):
+    """The semantics of the Version Minus One instructions, which
+    execute() applies to this Program.
+
+    >>> p = Semantics("(^?)(?$)")
+    >>> p.execute('0')
+    >>> print str(p)
+    (^?)0(?$)
+
+    >>> p = Semantics("(^@)(@$)")
+    >>> p.execute('@')
+    >>> print str(p)
+    (^@)@(@$)
+    >>> p = Semantics("(^`@)Jim(`@$)(^Jim)?(Jim$)")
+    >>> p.execute('@')
+    >>> print str(p)
+    (^`@)Jim(`@$)(^Jim)Jim(Jim$)
+
+    >>> p = Semantics("(^?)(?$)(^@)0(@$)(^0)Seven(0$)")
+    >>> p.execute('G')
+    >>> print str(p)
+    (^?)Seven(?$)(^@)0(@$)(^0)Seven(0$)
+
+    >>> p = Semantics("(^?)Meerkat(?$)(^@)0(@$)(^0)Seven(0$)")
+    >>> p.execute('P')
+    >>> print str(p)
+    (^?)Meerkat(?$)(^@)0(@$)(^0)Meerkat(0$)
+
+    >>> p = Semantics("(^?)!(?$)(^@)0(@$)(^0)Fenesrate(0$)")
+    >>> p.execute('A')
+    >>> print str(p)
+    (^?)!(?$)(^@)0(@$)(^0)!Fenesrate(0$)
+    >>> p.execute('Z')
+    >>> print str(p)
+    (^?)!(?$)(^@)0(@$)(^0)!Fenesrate!(0$)
+
+    >>> p = Semantics("(^@)0(@$)(^0)Seven(0$)")
+    >>> p.execute('X')
+    >>> print str(p)
+    (^@)0(@$)(^0)(0$)
+
+    >>> p = Semantics("(^@)0(@$)(^0)Licorice(0$)(^%)(%$)")
+    >>> p.execute('C')
+    >>> print str(p)
+    (^@)0(@$)(^0)Licorice(0$)(^%)Licorice(%$)
+
+    >>> p = Semantics("(^@)0(@$)(^0)Rock(0$)(^%)well(%$)")
+    >>> p.execute('V')
+    >>> print str(p)
+    (^@)0(@$)(^0)Rockwell(0$)(^%)well(%$)
+
+    >>> p = Semantics("(^@)0(@$)(^0)Rock(0$)(^%)well(%$)")
+    >>> p.execute('V')
+    >>> print str(p)
+    (^@)0(@$)(^0)Rockwell(0$)(^%)well(%$)
+
+    >>> p = Semantics("(^?)Hello, world!(?$)")
+    >>> p.execute('O')
+    Hello, world!
+    >>> print str(p)
+    (^?)Hello, world!(?$)
+
+    >>> from StringIO import StringIO
+    >>> p = Semantics("(^?)(?$)")
+    >>> p.input = StringIO(chr(10).join(["Line.", "Line!", "LINE!"]))
+    >>> p.execute('I')
+    >>> print str(p)
+    (^?)Line.(?$)
+    >>> p.execute('I')
+    >>> print str(p)
+    (^?)Line!(?$)
+    >>> p.execute('I')
+    >>> print str(p)
+    (^?)LINE!(?$)
+    >>> p.execute('I')
+    >>> print str(p)
+    (^?)(?$)
+
+    """
+    OPCODES = {
+        '0': 'op_literal', '1': 'op_literal', '2': 'op_literal',
+        '3': 'op_literal', '4': 'op_literal', '5': 'op_literal',
+        '6': 'op_literal', '7': 'op_literal', '8': 'op_literal',
+        '9': 'op_literal',
+        '@': 'op_index',
+        'G': 'op_get',
+        'P': 'op_put',
+        'A': 'op_prepend',
+        'Z': 'op_append',
+        'X': 'op_cut',
+        'C': 'op_copy',
+        'V': 'op_paste',
+        'O': 'op_output',
+        'I': 'op_input',
+    }
+
+    def op_literal(self, instruction):
+        self.update_slot(self.get_slot_name('?'), instruction)
+
+    def op_index(self, instruction):
+        self.update_slot(self.get_slot_name('@'), self.get_slot_name('@'))
+
+    def op_get(self, instruction):
+        self.update_slot(self.get_slot_name('?'), self.read_slot_indirect(self.get_slot_name('@')))
+
+    def op_put(self, instruction):
+        self.update_slot_indirect(self.get_slot_name('@'), self.read_slot('?'))
+
+    def op_prepend(self, instruction):
+        value = self.read_slot('?') + self.read_slot_indirect(self.get_slot_name('@'))
+        self.update_slot_indirect(self.get_slot_name('@'), value)
+
+    def op_append(self, instruction):
+        value = self.read_slot_indirect(self.get_slot_name('@')) + self.read_slot('?') 
+        self.update_slot_indirect(self.get_slot_name('@'), value)
+
+    def op_cut(self, instruction):
+        self.update_slot_indirect(self.get_slot_name('@'), '')
+
+    def op_copy(self, instruction):
+        self.update_slot(self.get_slot_name('%'), self.read_slot_indirect(self.get_slot_name('@')))
+
+    def op_paste(self, instruction):
+        value = self.read_slot_indirect(self.get_slot_name('@')) + self.read_slot('%')
+        self.update_slot_indirect(self.get_slot_name('@'), value)
+
+    def op_output(self, instruction):
+        line = self.read_slot('?') + "\n"
+        try:
+            self.output.write(line)
+        except UnicodeEncodeError:
+            self.output.write(line.encode('ascii', 'xmlcharrefreplace'))
+
+    def op_input(self, instruction):
+        text = self.input.readline()
+        if text.endswith('\n'):
+            text = text[:-1]
+        self.update_slot(self.get_slot_name('?'), text)
+
+    def step(self, limit=None):
         """Execute one step of this Pophery program.
 
         >>> p = Semantics("(^?)Hello, world!(?$)(^!)O(!$)")
@@ -147,7 +172,7 @@ class Semantics(Program):
         (^?)Hello, world!(?$)O(^!)(!$)
 
         """
-        return super(Semantics, self).step()
+        return super(Semantics, self).step(limit)
 
     def run(self):
         """Execute this Pophery program and return only when it terminates.
@@ -39,7 +39,16 @@ POSSIBILITY OF SUCH DAMAGE.
 """
 
 
+import json
+import math
+import os
+import random
+import re
+import socket
 import sys
+import time
+from bisect import bisect_right
+from itertools import accumulate
 from optparse import OptionParser
 
 
@@ -48,6 +57,1192 @@ class UndefinedLocatorError(Exception):
     pass
 
 
+class LocatorMark(object):
+    """A parenthesis in a string indexed by a LocatorIndex.  Its offset
+    is relative to the position of the first parenthesis in its block;
+    if it opens a simple locator, that locator is recorded too.
+
+    """
+    __slots__ = ('offset', 'kind', 'locator', 'block')
+
+    def __init__(self, offset, kind, block):
+        self.offset = offset
+        self.kind = kind
+        self.locator = None
+        self.block = block
+
+
+class LocatorBlock(object):
+    """A run of consecutive LocatorMarks, and the position of the block
+    in the list of blocks of its LocatorIndex.
+
+    """
+    __slots__ = ('marks', 'number')
+
+    def __init__(self, marks, number):
+        self.marks = marks
+        self.number = number
+        for mark in marks:
+            mark.block = self
+
+
+class LocatorIndex(object):
+    """Index from locator text to the positions at which it occurs.
+
+    Only simple locators -- a parenthesis, any number of characters which
+    are not parentheses, and a closing parenthesis -- are indexed; these
+    are the only locators Pophery ever needs to look up.  For each one,
+    a list of its occurrences, in order of position, is kept.  All the
+    parentheses in the string are kept too.
+
+    The index is maintained incrementally: when a span of the string is
+    replaced, only the locators near that span are rescanned.  The
+    parentheses are kept in blocks, each of which stores the positions
+    of its parentheses relative to its first one, with a Fenwick tree
+    of the differences between the positions of the blocks; so the
+    parentheses after the span are shifted in O(log n) time plus time
+    proportional to the size of a block.
+
+    >>> i = LocatorIndex("(^a)x(a$)y(^a)")
+    >>> i.find("(^a)")
+    0
+    >>> i.find("(a$)")
+    5
+    >>> i.find("(^b)")
+    -1
+    >>> i.find("(^a)y")
+    Traceback (most recent call last):
+    ...
+    KeyError: '(^a)y'
+
+    """
+    LOCATOR = re.compile(r'\([^()]*\)')
+    PAREN = re.compile(r'[()]')
+    BLOCK = 32
+
+    def __init__(self, string, state=None):
+        if state is None:
+            parens = [match.start() for match in self.PAREN.finditer(string)]
+        else:
+            parens = state['parens']
+        marks = self.build(parens, [string[pos] for pos in parens])
+        self.positions = {}
+        if state is None:
+            self.scan(string, 0, dict(zip(parens, marks)))
+        else:
+            at = dict(zip(parens, marks))
+            for (locator, positions) in state['positions'].items():
+                occurrences = [at[pos] for pos in positions]
+                for mark in occurrences:
+                    mark.locator = locator
+                self.positions[locator] = occurrences
+
+    def build(self, positions, kinds):
+        """Replace the contents of this index with marks for parentheses
+        of the given kinds at the given positions, and return the marks.
+
+        """
+        marks = []
+        self.blocks = []
+        bases = []
+        for start in range(0, len(positions), self.BLOCK):
+            base = positions[start]
+            block = LocatorBlock(
+                [LocatorMark(pos - base, kind, None) for (pos, kind) in
+                 zip(positions[start:start + self.BLOCK],
+                     kinds[start:start + self.BLOCK])],
+                len(self.blocks))
+            self.blocks.append(block)
+            bases.append(base)
+            marks.extend(block.marks)
+        self.build_tree(bases)
+        return marks
+
+    def build_tree(self, bases):
+        """Build the Fenwick tree of the differences between the given
+        positions of the blocks.
+
+        """
+        size = len(bases)
+        self.tree = [0] * (size + 1)
+        previous = 0
+        for (number, base) in enumerate(bases):
+            index = number + 1
+            self.tree[index] += base - previous
+            previous = base
+            parent = index + (index & -index)
+            if parent <= size:
+                self.tree[parent] += self.tree[index]
+
+    def bases(self):
+        """Return the positions of the first parentheses of all the
+        blocks.
+
+        """
+        tree = self.tree
+        sums = [0] * len(tree)
+        for index in range(1, len(tree)):
+            sums[index] = tree[index] + sums[index - (index & -index)]
+        return sums[1:]
+
+    def base(self, number):
+        """Return the position of the first parenthesis in the given
+        block.
+
+        """
+        tree = self.tree
+        index = number + 1
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def shift(self, number, delta):
+        """Add the given delta to the positions of the given block and
+        of every block after it.
+
+        """
+        tree = self.tree
+        index = number + 1
+        size = len(tree)
+        while index < size:
+            tree[index] += delta
+            index += index & -index
+
+    def position(self, mark):
+        return mark.offset + self.base(mark.block.number)
+
+    def state(self):
+        """Return the contents of this index as a dictionary which can be
+        stored as JSON, and from which an index of the same string can be
+        rebuilt without scanning the string again.
+
+        >>> i = LocatorIndex("(^a)x(a$)", LocatorIndex("(^a)x(a$)").state())
+        >>> i.find("(a$)"), i.state()['parens']
+        (5, [0, 3, 5, 8])
+
+        """
+        parens = []
+        for (block, base) in zip(self.blocks, self.bases()):
+            parens.extend([base + mark.offset for mark in block.marks])
+        positions = {}
+        for (locator, occurrences) in self.positions.items():
+            positions[locator] = [self.position(mark) for mark in occurrences]
+        return {'positions': positions, 'parens': parens}
+
+    def indexes(self, locator):
+        """Return True if the given string is the kind of locator which
+        can be looked up in this index.
+
+        >>> i = LocatorIndex("")
+        >>> i.indexes("(^!)")
+        True
+        >>> i.indexes("(^8(beat))")
+        False
+        >>> i.indexes("(!$)x")
+        False
+
+        """
+        match = self.LOCATOR.match(locator)
+        return match is not None and match.end() == len(locator)
+
+    def find(self, locator):
+        """Return the position of the leftmost occurrence of the given
+        locator, or -1 if it does not occur.
+
+        """
+        occurrences = self.positions.get(locator)
+        if occurrences:
+            mark = occurrences[0]
+            return mark.offset + self.base(mark.block.number)
+        if not self.indexes(locator):
+            raise KeyError(locator)
+        return -1
+
+    def first_at(self, pos):
+        """Return the number of the block, and the index within it, of
+        the first parenthesis at or after the given position.  If there
+        is none, the number returned is that of the last block, plus one.
+
+        """
+        # Find the last block which begins before the position.
+        tree = self.tree
+        size = len(tree) - 1
+        number = 0
+        remaining = pos - 1
+        bit = 1
+        while bit * 2 <= size:
+            bit *= 2
+        while bit:
+            probe = number + bit
+            if probe <= size and tree[probe] <= remaining:
+                number = probe
+                remaining -= tree[probe]
+            bit //= 2
+        if number == 0:
+            return (0, 0)
+        number -= 1
+        marks = self.blocks[number].marks
+        offset = remaining + 1
+        (low, high) = (0, len(marks))
+        while low < high:
+            middle = (low + high) // 2
+            if marks[middle].offset < offset:
+                low = middle + 1
+            else:
+                high = middle
+        if low == len(marks):
+            return (number + 1, 0)
+        return (number, low)
+
+    def span(self, start, end):
+        """Return the positions between which the index must be rescanned
+        if the characters between the two given positions are replaced,
+        widened so that no locator straddles either end.
+
+        >>> i = LocatorIndex("(^a)xyz(a$)")
+        >>> i.span(2, 2), i.span(4, 5), i.span(5, 8), i.span(9, 9)
+        ((0, 4), (4, 5), (5, 11), (7, 11))
+
+        """
+        blocks = self.blocks
+        left = start
+        (number, index) = self.first_at(start)
+        if index > 0:
+            mark = blocks[number].marks[index - 1]
+        elif number > 0:
+            mark = blocks[number - 1].marks[-1]
+        else:
+            mark = None
+        if mark is not None and mark.kind == '(':
+            left = self.position(mark)
+        right = end
+        (number, index) = self.first_at(end)
+        if number < len(blocks):
+            mark = blocks[number].marks[index]
+            if mark.kind == ')':
+                right = self.position(mark) + 1
+        return (left, right)
+
+    def scan(self, string, offset, marks):
+        """Add all the locators found in the given string, which occurs
+        at the given offset, to the index, given the marks for the
+        parentheses in it by position.  Returns the set of locators
+        which were added.
+
+        """
+        found = set()
+        for match in self.LOCATOR.finditer(string):
+            locator = match.group()
+            pos = match.start() + offset
+            mark = marks[pos]
+            mark.locator = locator
+            occurrences = self.positions.get(locator)
+            if occurrences is None:
+                self.positions[locator] = [mark]
+            else:
+                (low, high) = (0, len(occurrences))
+                while low < high:
+                    middle = (low + high) // 2
+                    if self.position(occurrences[middle]) < pos:
+                        low = middle + 1
+                    else:
+                        high = middle
+                occurrences.insert(low, mark)
+            found.add(locator)
+        return found
+
+    def rebase(self, number):
+        """Make the first parenthesis of the given block the one its
+        position is relative to, or remove the block if it is empty.
+
+        """
+        marks = self.blocks[number].marks
+        if not marks:
+            bases = self.bases()
+            del bases[number]
+            del self.blocks[number]
+            for block in self.blocks[number:]:
+                block.number -= 1
+            self.build_tree(bases)
+            return
+        first = marks[0].offset
+        if first != 0:
+            for mark in marks:
+                mark.offset -= first
+            self.shift(number, first)
+            if number + 1 < len(self.blocks):
+                self.shift(number + 1, -first)
+
+    def split(self, number):
+        """Split the given block into blocks of the usual size."""
+        bases = self.bases()
+        block = self.blocks[number]
+        pieces = []
+        for start in range(self.BLOCK, len(block.marks), self.BLOCK):
+            marks = block.marks[start:start + self.BLOCK]
+            first = marks[0].offset
+            for mark in marks:
+                mark.offset -= first
+            pieces.append(LocatorBlock(marks, None))
+            bases.insert(number + len(pieces), bases[number] + first)
+        del block.marks[self.BLOCK:]
+        self.blocks[number + 1:number + 1] = pieces
+        for (index, later) in enumerate(self.blocks[number + 1:]):
+            later.number = number + 1 + index
+        self.build_tree(bases)
+
+    def replace(self, left, old_right, string):
+        """Account for the span between the given left position and the
+        given old right position having been replaced by the given string.
+
+        No locator may straddle either end of the span.  Returns the set
+        of locators which were removed from or added to the index.
+
+        >>> i = LocatorIndex("(^a)x(a$)y(^b)")
+        >>> sorted(i.replace(4, 10, "(^c)"))
+        ['(^c)', '(a$)']
+        >>> i.find("(^b)")
+        8
+        >>> i.find("(^c)")
+        4
+        >>> i.find("(a$)")
+        -1
+
+        >>> i = LocatorIndex("".join(["(%d)" % n for n in range(100)]))
+        >>> len(i.blocks), i.span(4, 300)
+        (7, (3, 302))
+        >>> len(i.replace(3, 302, "xy"))
+        77
+        >>> len(i.blocks), i.find("(0)"), i.find("(79)"), i.find("(99)")
+        (4, 0, 9, 89)
+
+        """
+        delta = len(string) - (old_right - left)
+        changed = set()
+        parens = [match.start() + left
+                  for match in self.PAREN.finditer(string)]
+        blocks = self.blocks
+        (number, index) = self.first_at(left)
+        if number == len(blocks):
+            if not blocks:
+                marks = self.build(parens,
+                                   [string[pos - left] for pos in parens])
+                return self.scan(string, left, dict(zip(parens, marks)))
+            number -= 1
+            index = len(blocks[number].marks)
+        block = blocks[number]
+        marks = block.marks
+        base = self.base(number)
+
+        # Remove the parentheses in the span, which may go on into the
+        # blocks after this one.
+        stop = index
+        while stop < len(marks) and marks[stop].offset + base < old_right:
+            stop += 1
+        removed = marks[index:stop]
+        if stop == len(marks):
+            later = number + 1
+            while later < len(blocks):
+                after = blocks[later].marks
+                after_base = self.base(later)
+                end = 0
+                while (end < len(after) and
+                       after[end].offset + after_base < old_right):
+                    end += 1
+                removed.extend(after[:end])
+                del after[:end]
+                if after:
+                    if end > 0:
+                        self.rebase(later)
+                    break
+                later += 1
+            if later > number + 1:
+                bases = self.bases()
+                del bases[number + 1:later]
+                del blocks[number + 1:later]
+                for (offset, after) in enumerate(blocks[number + 1:]):
+                    after.number = number + 1 + offset
+                self.build_tree(bases)
+        for mark in removed:
+            if mark.locator is not None:
+                occurrences = self.positions[mark.locator]
+                occurrences.remove(mark)
+                if not occurrences:
+                    del self.positions[mark.locator]
+                changed.add(mark.locator)
+
+        # Put the parentheses in the string in their place, and shift
+        # the ones after it.
+        added = [LocatorMark(pos - base, string[pos - left], block)
+                 for pos in parens]
+        if delta != 0:
+            for mark in marks[stop:]:
+                mark.offset += delta
+            if number + 1 < len(blocks):
+                self.shift(number + 1, delta)
+        marks[index:stop] = added
+        if index == 0:
+            self.rebase(number)
+        if len(marks) > 2 * self.BLOCK:
+            self.split(number)
+        if added:
+            changed.update(self.scan(string, left, dict(zip(parens, added))))
+        return changed
+
+
+class TextStore(object):
+    """Base class for the backing stores of MutableStrings.
+
+    A backing store holds the text of a MutableString and supports
+    indexing, slicing, searching, and splicing it.  Subclasses may also
+    provide faster versions of the scanning operations defined here.
+
+    """
+    def find_matching(self, pos):
+        """Return the position of the parenthesis which matches the
+        parenthesis at the given position, or None.  See
+        MutableString.find_matching.
+
+        """
+        opener = self[pos]
+        if opener == u'(':
+            closer = u')'
+            dir = +1
+        elif opener == u')':
+            closer = u'('
+            dir = -1
+        else:
+            return None
+        level = 0
+        length = len(self)
+        while pos < length:
+            char = self[pos]
+            if char == opener:
+                level += 1
+            elif char == closer:
+                level -= 1
+                if level == 0:
+                    return pos
+            pos += dir
+        return None
+
+    def tokens(self, start, end):
+        """Return the text between the two given positions as a list of
+        tokens, as produced by TokenStore.lex(), or None if this store
+        does not keep track of tokens.
+
+        """
+        return None
+
+
+class StringStore(TextStore):
+    """Backing store for a MutableString which keeps its contents in a
+    single Python string.
+
+    This is the simplest store, and the fastest for small programs, but
+    every edit copies the whole string.
+
+    """
+    def __init__(self, initial):
+        self.string = initial
+
+    def __str__(self):
+        return self.string
+
+    def __len__(self):
+        return len(self.string)
+
+    def __getitem__(self, index):
+        return self.string[index]
+
+    def find(self, sub, start=0):
+        return self.string.find(sub, start)
+
+    def splice(self, start, end, string):
+        self.string = self.string[:start] + string + self.string[end:]
+
+
+class RopeNode(object):
+    """A node of the treap which makes up a RopeStore.  Each node holds
+    one chunk of the text; the text is read by an in-order traversal.
+
+    """
+    __slots__ = ('chunk', 'priority', 'left', 'right', 'size')
+
+    def __init__(self, chunk):
+        self.chunk = chunk
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+        self.size = len(chunk)
+
+    def resize(self):
+        size = len(self.chunk)
+        if self.left is not None:
+            size += self.left.size
+        if self.right is not None:
+            size += self.right.size
+        self.size = size
+
+
+class RopeStore(TextStore):
+    """Backing store for a MutableString which keeps its contents in a
+    rope: a randomized balanced tree (treap) of chunks of text, keyed
+    implicitly by position.
+
+    Splicing, indexing, and slicing take O(log n) time plus time
+    proportional to the length of the text involved, and never
+    materialize the whole string.
+
+    >>> r = RopeStore("Momentous")
+    >>> r.CHUNK = 2
+    >>> r.splice(3, 3, "(*)")
+    >>> print(str(r))
+    Mom(*)entous
+    >>> print(r[4] + r[-1] + r[2:8])
+    *sm(*)en
+    >>> r.find("en"), r.find("(+)")
+    (6, -1)
+    >>> r.splice(0, 7, "")
+    >>> print(str(r))
+    ntous
+
+    """
+    CHUNK = 512
+    NODE = RopeNode
+
+    def __init__(self, initial):
+        self.root = self.build(initial)
+
+    def build(self, string):
+        root = None
+        for pos in range(0, len(string), self.CHUNK):
+            root = self.merge(root, self.NODE(string[pos:pos + self.CHUNK]))
+        return root
+
+    def __str__(self):
+        return self[0:len(self)]
+
+    def __len__(self):
+        if self.root is None:
+            return 0
+        return self.root.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            pieces = []
+            self.collect(self.root, start, stop, pieces)
+            return ''.join(pieces)
+        if index < 0:
+            index += len(self)
+        node = self.root
+        while node is not None:
+            lsize = 0
+            if node.left is not None:
+                lsize = node.left.size
+            if index < lsize:
+                node = node.left
+                continue
+            index -= lsize
+            if index < len(node.chunk):
+                return node.chunk[index]
+            index -= len(node.chunk)
+            node = node.right
+        raise IndexError("string index out of range")
+
+    def collect(self, node, start, end, pieces):
+        """Append the chunks (or parts of chunks) of the given subtree
+        which lie between the given positions to the given list.
+
+        """
+        while node is not None and start < end:
+            lsize = 0
+            if node.left is not None:
+                lsize = node.left.size
+            if start < lsize:
+                self.collect(node.left, start, min(end, lsize), pieces)
+            a = max(start - lsize, 0)
+            b = min(end - lsize, len(node.chunk))
+            if a < b:
+                pieces.append(node.chunk[a:b])
+            start = max(start - lsize - len(node.chunk), 0)
+            end -= lsize + len(node.chunk)
+            node = node.right
+
+    def chunks(self, start):
+        """Yield (position, chunk) pairs for each chunk which ends after
+        the given position, from left to right.
+
+        """
+        stack = []
+        node = self.root
+        offset = 0
+        while True:
+            while node is not None:
+                begin = offset
+                if node.left is not None:
+                    begin += node.left.size
+                if start < begin + len(node.chunk):
+                    stack.append((node, begin))
+                    if start < begin:
+                        node = node.left
+                        continue
+                    break
+                offset = begin + len(node.chunk)
+                node = node.right
+            if not stack:
+                return
+            (node, begin) = stack.pop()
+            yield (begin, node.chunk)
+            offset = begin + len(node.chunk)
+            node = node.right
+
+    def find(self, sub, start=0):
+        if sub == '':
+            return start if start <= len(self) else -1
+        keep = len(sub) - 1
+        carry = ''
+        for (begin, chunk) in self.chunks(start):
+            if begin < start:
+                chunk = chunk[start - begin:]
+                begin = start
+            text = carry + chunk
+            pos = text.find(sub)
+            if pos != -1:
+                return begin - len(carry) + pos
+            if keep > 0:
+                carry = text[-keep:]
+        return -1
+
+    def split(self, node, pos):
+        """Split the given subtree into two subtrees, the first holding
+        the first pos characters and the second holding the rest.
+
+        """
+        if node is None:
+            return (None, None)
+        lsize = 0
+        if node.left is not None:
+            lsize = node.left.size
+        if pos <= lsize:
+            (left, right) = self.split(node.left, pos)
+            node.left = right
+            node.resize()
+            return (left, node)
+        pos -= lsize
+        if pos >= len(node.chunk):
+            (left, right) = self.split(node.right, pos - len(node.chunk))
+            node.right = left
+            node.resize()
+            return (node, right)
+        right = self.NODE(node.chunk[pos:])
+        right.priority = node.priority
+        right.right = node.right
+        right.resize()
+        node.chunk = node.chunk[:pos]
+        node.right = None
+        node.resize()
+        return (node, right)
+
+    def merge(self, left, right):
+        """Join the two given subtrees into one."""
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self.merge(left.right, right)
+            left.resize()
+            return left
+        right.left = self.merge(left, right.left)
+        right.resize()
+        return right
+
+    def edge(self, node, last):
+        """Return the first (or last) node of the given subtree."""
+        while node is not None:
+            child = node.right if last else node.left
+            if child is None:
+                return node
+            node = child
+        return None
+
+    def splice(self, start, end, string):
+        (left, rest) = self.split(self.root, start)
+        (middle, right) = self.split(rest, end - start)
+        # Absorb small neighbouring chunks, so that repeated small edits
+        # do not fragment the rope into single characters.
+        node = self.edge(left, True)
+        if node is not None and len(node.chunk) + len(string) <= self.CHUNK:
+            (left, node) = self.split(left, left.size - len(node.chunk))
+            string = node.chunk + string
+        node = self.edge(right, False)
+        if node is not None and len(node.chunk) + len(string) <= self.CHUNK:
+            (node, right) = self.split(right, len(node.chunk))
+            string = string + node.chunk
+        self.root = self.merge(self.merge(left, self.build(string)), right)
+
+
+class HashedRopeNode(RopeNode):
+    """A node of the treap which makes up a HashedRopeStore.  Besides its
+    size, each node keeps the hash of the text of its subtree, and the
+    base of the hash raised to the length of that text, so that the
+    hashes of two subtrees can be combined into the hash of the two
+    texts joined together.  The hash is None while it is out of date.
+
+    """
+    __slots__ = ('hashed', 'chunk_hash', 'chunk_power', 'hash', 'power')
+
+    def __init__(self, chunk):
+        super(HashedRopeNode, self).__init__(chunk)
+        self.hashed = None
+        self.hash = None
+
+    def resize(self):
+        super(HashedRopeNode, self).resize()
+        self.hash = None
+
+
+class HashedRopeStore(RopeStore):
+    """A RopeStore which can give a polynomial hash of its contents.  The
+    hash of each node of the rope is kept until the node is changed, so
+    after a splice only the nodes which the splice changed are hashed
+    again, taking O(log n) time plus time proportional to the length of
+    the chunks involved.
+
+    The hash is that of the contents read as a number in base 2**32, one
+    digit per character, modulo the prime 2**64 - 59.  (2 is a primitive
+    root of that prime, so the powers of the base do not repeat for any
+    length of text which will fit in memory, as they would modulo a
+    Mersenne prime.)
+
+    >>> r = HashedRopeStore("Momentous")
+    >>> r.CHUNK = 2
+    >>> r.splice(3, 3, "(*)")
+    >>> r.digest() == HashedRopeStore("Mom(*)entous").digest()
+    True
+    >>> r.splice(3, 6, "")
+    >>> r.digest() == HashedRopeStore("Momentous").digest()
+    True
+    >>> r.digest() == HashedRopeStore("Momentuos").digest()
+    False
+
+    """
+    NODE = HashedRopeNode
+    MODULUS = 2 ** 64 - 59
+
+    def digest(self):
+        """Return the hash of the contents of this store."""
+        if self.root is None:
+            return 0
+        return self.rehash(self.root)
+
+    def rehash(self, node):
+        """Bring the hash of the given subtree up to date, and return it."""
+        if node.hash is not None:
+            return node.hash
+        modulus = self.MODULUS
+        if node.hashed is not node.chunk:
+            node.hashed = node.chunk
+            node.chunk_hash = int.from_bytes(
+                node.chunk.encode('utf-32-be', 'surrogatepass'), 'big') % modulus
+            node.chunk_power = pow(2, 32 * len(node.chunk), modulus)
+        (hash, power) = (node.chunk_hash, node.chunk_power)
+        if node.left is not None:
+            hash = (self.rehash(node.left) * power + hash) % modulus
+            power = node.left.power * power % modulus
+        if node.right is not None:
+            right = self.rehash(node.right)
+            hash = (hash * node.right.power + right) % modulus
+            power = power * node.right.power % modulus
+        node.hash = hash
+        node.power = power
+        return hash
+
+
+class GapBufferStore(TextStore):
+    """Backing store for a MutableString which keeps its contents in a
+    gap buffer: a list of characters with a run of unused slots (the gap)
+    at the position of the most recent edit.
+
+    Each edit first moves the gap to where the edit takes place, which
+    costs time proportional to the distance moved, and then fills or
+    widens the gap in place.  Since most edits happen around the
+    instruction slot, the gap tends to follow it, and advancing the
+    instruction slot costs only a few characters' worth of work instead
+    of a copy of the whole string.
+
+    >>> g = GapBufferStore("Momentous")
+    >>> g.splice(3, 3, "(*)")
+    >>> print(str(g))
+    Mom(*)entous
+    >>> g.splice(3, 7, "(*)e")
+    >>> print(str(g))
+    Mom(*)entous
+    >>> g.gap_start
+    7
+    >>> print(g[4] + g[-1] + g[2:8])
+    *sm(*)en
+    >>> g.find("en"), g.find("(+)")
+    (6, -1)
+
+    """
+    def __init__(self, initial):
+        self.buffer = list(initial)
+        self.gap_start = len(self.buffer)
+        self.gap_end = len(self.buffer)
+
+    def __str__(self):
+        return (''.join(self.buffer[:self.gap_start]) +
+                ''.join(self.buffer[self.gap_end:]))
+
+    def __len__(self):
+        return len(self.buffer) - (self.gap_end - self.gap_start)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step != 1:
+                return str(self)[index]
+            if stop <= self.gap_start:
+                return ''.join(self.buffer[start:stop])
+            gap = self.gap_end - self.gap_start
+            if start >= self.gap_start:
+                return ''.join(self.buffer[start + gap:stop + gap])
+            return (''.join(self.buffer[start:self.gap_start]) +
+                    ''.join(self.buffer[self.gap_end:stop + gap]))
+        if index < 0:
+            index += len(self)
+            if index < 0:
+                raise IndexError("string index out of range")
+        if index >= self.gap_start:
+            index += self.gap_end - self.gap_start
+        return self.buffer[index]
+
+    def find(self, sub, start=0):
+        return str(self).find(sub, start)
+
+    def move_gap(self, pos):
+        """Move the gap so that it begins at the given position."""
+        buffer = self.buffer
+        if pos < self.gap_start:
+            count = self.gap_start - pos
+            buffer[self.gap_end - count:self.gap_end] = buffer[pos:self.gap_start]
+            self.gap_start -= count
+            self.gap_end -= count
+        elif pos > self.gap_start:
+            count = pos - self.gap_start
+            buffer[self.gap_start:pos] = buffer[self.gap_end:self.gap_end + count]
+            self.gap_start += count
+            self.gap_end += count
+
+    def splice(self, start, end, string):
+        self.move_gap(start)
+        self.gap_end += end - start
+        if len(string) > self.gap_end - self.gap_start:
+            grow = len(string) + len(self.buffer) // 2 + 16
+            self.buffer[self.gap_end:self.gap_end] = [None] * grow
+            self.gap_end += grow
+        self.buffer[self.gap_start:self.gap_start + len(string)] = string
+        self.gap_start += len(string)
+
+
+class TokenStore(TextStore):
+    """Backing store for a MutableString which keeps its contents as a
+    sequence of tokens.  Each token is either a balanced parenthesized
+    group, such as a locator, or a single character.
+
+    The program is lexed once, when the store is created.  After that,
+    each edit re-lexes only the tokens it touches, unless it changes
+    how the parentheses elsewhere in the string match up, in which
+    case the whole string is lexed again.  This makes finding matching
+    parentheses, and so sliding locators over other locators, a matter
+    of looking up a token.  It also allows the contents of a slot to be
+    read as tokens, so locators need not be stripped from them by
+    scanning parentheses.
+
+    The tokens are kept in blocks, with a Fenwick tree of the lengths of
+    the blocks, and the ends of the tokens in a block are summed the
+    first time it is searched after it changes, so that finding the
+    token at a position takes O(log n) time.
+
+    Re-lexing the tokens around each edit, and keeping the blocks up to
+    date, cost more than they save on the programs the benchmarks run:
+    a TokenStore runs them several times slower than a plain string.
+    It is meant as a reference for what knowing the tokens makes
+    cheaper, not as the fastest engine.
+
+    >>> t = TokenStore("Mom(*)ent(+(-))ous")
+    >>> t.tokens(0, len(t))
+    ['M', 'o', 'm', '(*)', 'e', 'n', 't', '(+(-))', 'o', 'u', 's']
+    >>> t.find_matching(9), t.find_matching(14), t.find_matching(11)
+    (14, 9, 13)
+    >>> t.splice(6, 15, "(")
+    >>> print(str(t))
+    Mom(*)(ous
+    >>> print(t.tokens(3, 10))
+    ['(*)', '(', 'o', 'u', 's']
+    >>> t.splice(9, 9, ")")
+    >>> print(t.tokens(3, 11))
+    ['(*)', '(ou)', 's']
+    >>> print(t.tokens(4, 11))
+    None
+    >>> TokenStore("x)((y)").find_matching(-3)
+    -1
+
+    """
+    BLOCK = 64
+    PAREN = re.compile(r'[()]')
+
+    def __init__(self, initial):
+        self.rebuild(self.lex(initial)[0])
+
+    def lex(self, text):
+        """Split the given text into tokens.  Returns the tokens, and
+        whether every parenthesis in the text was part of a balanced
+        group.
+
+        """
+        parens = [match.start() for match in self.PAREN.finditer(text)]
+        matches = {}
+        stack = []
+        for pos in parens:
+            if text[pos] == '(':
+                stack.append(pos)
+            elif stack:
+                matches[stack.pop()] = pos
+        tokens = []
+        balanced = True
+        pos = 0
+        for paren in parens:
+            if paren < pos:
+                continue
+            tokens.extend(text[pos:paren])
+            if paren in matches:
+                pos = matches[paren] + 1
+                tokens.append(text[paren:pos])
+            else:
+                tokens.append(text[paren])
+                balanced = False
+                pos = paren + 1
+        tokens.extend(text[pos:])
+        return (tokens, balanced)
+
+    def rebuild(self, tokens):
+        self.blocks = [tokens[pos:pos + self.BLOCK]
+                       for pos in range(0, len(tokens), self.BLOCK)]
+        self.lengths = [sum([len(token) for token in block])
+                        for block in self.blocks]
+        self.ends = [None] * len(self.blocks)
+        self.build_tree()
+
+    def build_tree(self):
+        """Build the Fenwick tree of the lengths of the blocks."""
+        self.length = sum(self.lengths)
+        size = len(self.lengths)
+        self.tree = [0] * (size + 1)
+        for (index, length) in enumerate(self.lengths):
+            index += 1
+            self.tree[index] += length
+            parent = index + (index & -index)
+            if parent <= size:
+                self.tree[parent] += self.tree[index]
+        self.top = 1
+        while self.top * 2 < len(self.tree):
+            self.top *= 2
+
+    def resize(self, block, delta):
+        """Add the given delta to the length of the given block."""
+        self.lengths[block] += delta
+        block += 1
+        while block < len(self.tree):
+            self.tree[block] += delta
+            block += block & -block
+
+    def locate(self, pos):
+        """Return the block and index within that block of the token
+        which contains the given position, and the position at which
+        that token begins.  A position at the end of the string is
+        located just past the last block.
+
+        """
+        if pos >= self.length:
+            return (len(self.blocks), 0, self.length)
+        tree = self.tree
+        size = len(tree)
+        block = 0
+        begin = 0
+        bit = self.top
+        while bit:
+            probe = block + bit
+            if probe < size and begin + tree[probe] <= pos:
+                block = probe
+                begin += tree[probe]
+            bit //= 2
+        ends = self.ends[block]
+        if ends is None:
+            ends = list(accumulate([len(token) for token in self.blocks[block]]))
+            self.ends[block] = ends
+        index = bisect_right(ends, pos - begin)
+        if index > 0:
+            begin += ends[index - 1]
+        return (block, index, begin)
+
+    def iterate(self, block, index):
+        """Yield the tokens from the given one onward."""
+        while block < len(self.blocks):
+            for token in self.blocks[block][index:]:
+                yield token
+            block += 1
+            index = 0
+
+    def __str__(self):
+        return ''.join([''.join(block) for block in self.blocks])
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(self.length)
+            if step != 1:
+                return str(self)[index]
+            if start >= stop:
+                return ''
+            (block, token, begin) = self.locate(start)
+            pieces = []
+            end = begin
+            for text in self.iterate(block, token):
+                if end >= stop:
+                    break
+                pieces.append(text)
+                end += len(text)
+            return ''.join(pieces)[start - begin:stop - begin]
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("string index out of range")
+        (block, token, begin) = self.locate(index)
+        return self.blocks[block][token][index - begin]
+
+    def find(self, sub, start=0):
+        if start < 0:
+            start = max(start + self.length, 0)
+        if sub == '':
+            return start if start <= self.length else -1
+        (block, index, pos) = self.locate(start)
+        keep = len(sub) - 1
+        carry = ''
+        while block < len(self.blocks):
+            chunk = ''.join(self.blocks[block][index:])
+            if pos < start:
+                chunk = chunk[start - pos:]
+                pos = start
+            text = carry + chunk
+            found = text.find(sub)
+            if found != -1:
+                return pos - len(carry) + found
+            pos += len(chunk)
+            if keep > 0:
+                carry = text[-keep:]
+            block += 1
+            index = 0
+        return -1
+
+    def find_matching(self, pos):
+        if pos < 0:
+            # Scanning past the start of the string goes on from its end,
+            # as indexing a Python string would; leave that to the general
+            # method, so the positions it returns are the same.
+            return super(TokenStore, self).find_matching(pos)
+        (block, index, begin) = self.locate(pos)
+        if block >= len(self.blocks):
+            return None
+        text = self.blocks[block][index]
+        if len(text) == 1:
+            if text == ')':
+                # An unmatched closing parenthesis; let the general method
+                # decide what to make of it.
+                return super(TokenStore, self).find_matching(pos)
+            return None
+        if pos == begin:
+            return begin + len(text) - 1
+        if pos == begin + len(text) - 1:
+            return begin
+        matching = StringStore(text).find_matching(pos - begin)
+        if matching is None:
+            return None
+        return begin + matching
+
+    def tokens(self, start, end):
+        if start >= end:
+            return []
+        (block, index, begin) = self.locate(start)
+        if begin != start:
+            return None
+        tokens = []
+        for text in self.iterate(block, index):
+            if begin >= end:
+                break
+            tokens.append(text)
+            begin += len(text)
+        if begin != end:
+            return None
+        return tokens
+
+    def splice(self, start, end, string):
+        (first, index, begin) = self.locate(start)
+        (last, stop, finish) = self.locate(end)
+        if finish < end:
+            finish += len(self.blocks[last][stop])
+            stop += 1
+        merged = []
+        for block in self.blocks[first:last + 1]:
+            merged.extend(block)
+        stop += sum([len(block) for block in self.blocks[first:last]])
+        old = merged[index:stop]
+        text = ''.join(old)
+        (tokens, balanced) = self.lex(
+            text[:start - begin] + string + text[end - begin:]
+        )
+        if not balanced or '(' in old or ')' in old:
+            # The edit may change which parentheses match elsewhere.
+            text = str(self)
+            self.rebuild(self.lex(text[:start] + string + text[end:])[0])
+            return
+        merged[index:stop] = tokens
+        if len(merged) <= 2 * self.BLOCK:
+            blocks = [merged] if merged else []
+        else:
+            blocks = [merged[pos:pos + self.BLOCK]
+                      for pos in range(0, len(merged), self.BLOCK)]
+        lengths = [sum([len(token) for token in block]) for block in blocks]
+        self.ends[first:last + 1] = [None] * len(blocks)
+        if len(blocks) == len(self.blocks[first:last + 1]):
+            self.blocks[first:last + 1] = blocks
+            for (offset, length) in enumerate(lengths):
+                self.resize(first + offset,
+                            length - self.lengths[first + offset])
+            self.length += len(string) - (end - start)
+        else:
+            self.blocks[first:last + 1] = blocks
+            self.lengths[first:last + 1] = lengths
+            self.build_tree()
+
+
+ENGINES = {
+    'string': StringStore,
+    'rope': RopeStore,
+    'gap': GapBufferStore,
+    'token': TokenStore,
+}
+
+
 class MutableString(object):
     """String-like object which may be updated in place.
 
@@ -62,30 +1257,180 @@ class MutableString(object):
     If the locator is not unique, the behaviour of a change made
     relative to it is undefined.
 
+    The contents are kept in a backing store, selected by name from
+    ENGINES: 'string' (the default) keeps them in a plain Python string,
+    'rope' keeps them in a RopeStore, which is better suited to large
+    programs, 'gap' keeps them in a GapBufferStore, which is better
+    suited to programs whose edits happen mostly near one place, and
+    'token' keeps them in a TokenStore, which knows which parentheses
+    match without scanning for them.
+
+    If indexed is true, the positions of the locators in the
+    MutableString are kept in a LocatorIndex, so that finding a locator
+    does not require searching the whole string.  If it is None (the
+    default), they are kept if the contents are not kept in a plain
+    string, since searching any other store means building its text
+    first, or if the contents, when they were last set, were at least
+    INDEX_LENGTH characters long; searching a shorter plain string is
+    faster than keeping its index up to date.
+
+    >>> MutableString("Momentous").index is None
+    True
+    >>> MutableString("Momentous" * 1000).index is None
+    False
+    >>> MutableString("Momentous", engine='gap').index is None
+    False
+
+    >>> a = MutableString("Mom(*)entous", engine='rope')
+    >>> a.move_locator("(*)", +3)
+    >>> print(str(a))
+    Moment(*)ous
+    >>> print(a[6:9])
+    (*)
+
     """
-    def __init__(self, initial):
-        self.string = initial
+    INDEX_LENGTH = 8192
+
+    def __init__(self, initial, engine='string', indexed=None):
+        self.engine = engine
+        self.indexed = indexed
+        self.store = ENGINES[engine](initial)
+        self.index = None
+        if self.wants_index(initial):
+            self.index = LocatorIndex(initial)
+
+    @property
+    def string(self):
+        return str(self.store)
 
     def __str__(self):
         return self.__unicode__()
 
     def __unicode__(self):
-        return self.string
+        return str(self.store)
 
     def __len__(self):
-        return len(self.string)
+        return len(self.store)
     
     def __getitem__(self, index):
-        return self.string[index]
+        return self.store[index]
 
     def __getslice__(self, i, j):
-        return self.string[i:j]
+        return self.store[i:j]
 
     def find(self, sub):
-        return self.string.find(sub)
+        if self.index is not None:
+            try:
+                return self.index.find(sub)
+            except KeyError:
+                pass
+        return self.store.find(sub)
     
-    def set(self, string):
-        self.string = string
+    def wants_index(self, string):
+        if self.indexed is None:
+            return (self.engine != 'string' or
+                    len(string) >= self.INDEX_LENGTH)
+        return self.indexed
+
+    def set(self, string, index_state=None):
+        self.store = ENGINES[self.engine](string)
+        self.index = None
+        if self.wants_index(string):
+            self.index = LocatorIndex(string, state=index_state)
+
+    def splice(self, start, end, string):
+        """Replace the characters between the two given positions with
+        the given string.
+
+        Every change to the contents of a MutableString, other than
+        replacing them wholesale with set(), is made through this method.
+        Returns the set of locators which were created or destroyed by
+        the change, or None if this MutableString is not indexed.
+
+        >>> a = MutableString("Mom(*)entous", indexed=True)
+        >>> sorted(a.splice(3, 6, "(+)ent(-)"))
+        ['(*)', '(+)', '(-)']
+        >>> print(str(a))
+        Mom(+)ent(-)entous
+        >>> print(a.pos_left("(-)", 0))
+        9
+        >>> a.splice(3, 3, "(")
+        set()
+        >>> print(a.find("(+)"))
+        4
+        >>> sorted(a.splice(5, 6, "="))
+        ['(+)', '(=)']
+        >>> print(str(a))
+        Mom((=)ent(-)entous
+        >>> sorted(a.splice(9, 4, ""))
+        ['(=)']
+        >>> print(str(a))
+        Mom((=)en(=)ent(-)entous
+
+        Negative positions count from the end, and positions past either
+        end are clamped to it, as in slicing a Python string.
+
+        >>> a = MutableString("abcdef(*)gh", indexed=True)
+        >>> sorted(a.splice(-3, -3, "(+)"))
+        ['(*)', '(+)']
+        >>> print(str(a))
+        abcdef(*(+))gh
+        >>> a.splice(-30, 1, "")
+        set()
+        >>> print(str(a))
+        bcdef(*(+))gh
+        >>> print(a.find("(+)"))
+        7
+
+        All the backing stores see the same positions.
+
+        >>> for engine in sorted(ENGINES):
+        ...     a = MutableString("abcdef(*)gh", engine=engine, indexed=False)
+        ...     a.splice(-3, -3, "X")
+        ...     print(engine, str(a))
+        gap abcdef(*X)gh
+        rope abcdef(*X)gh
+        string abcdef(*X)gh
+        token abcdef(*X)gh
+
+        """
+        (start, end, string) = self.resolve_splice(start, end, string)
+        store = self.store
+        if self.index is None:
+            store.splice(start, end, string)
+            return None
+        (left, right) = self.index.span(start, end)
+        store.splice(start, end, string)
+        delta = len(string) - (end - start)
+        return self.index.replace(left, right, store[left:right + delta])
+
+    def resolve_splice(self, start, end, string):
+        """Return the positions and string with which splice() makes the
+        given change: negative positions count from the end, positions
+        past either end are clamped to it, and a span whose end precedes
+        its start is made empty, its characters being repeated after the
+        string instead, as slicing a Python string would.
+
+        >>> a = MutableString("abcdef")
+        >>> a.resolve_splice(-2, 10, "X")
+        (4, 6, 'X')
+        >>> a.resolve_splice(4, 1, "X")
+        (4, 4, 'Xbcd')
+
+        """
+        length = len(self.store)
+        if start < 0:
+            start = max(start + length, 0)
+        elif start > length:
+            start = length
+        if end < 0:
+            end = max(end + length, 0)
+        elif end > length:
+            end = length
+        if end < start:
+            string = string + self[end:start]
+            end = start
+        return (start, end, string)
 
     def pos_left(self, locator, delta):
         """Return the 0-based position within this MutableString of the
@@ -136,7 +1481,7 @@ class MutableString(object):
         Mom(*)entous
 
         """
-        self.set(self[:pos] + locator + self[pos:])
+        self.splice(pos, pos, locator)
 
     def remove_locator(self, locator):
         """Remove the given locator from this string.
@@ -149,7 +1494,7 @@ class MutableString(object):
         """
         posl = self.pos_left(locator, 0)
         posr = self.pos_right(locator, 0)
-        self.set(self[:posl] + self[posr:])
+        self.splice(posl, posr, '')
 
     def move_locator(self, locator, delta):
         """Change the position of the given locator by the given delta.
@@ -165,9 +1510,16 @@ class MutableString(object):
         """
         posl = self.pos_left(locator, 0)
         posr = self.pos_right(locator, 0)
-        self.set(self[:posl] + self[posr:])
-        posl = posl + delta
-        self.set(self[:posl] + locator + self[posl:])
+        if delta > 0 and posr + delta <= len(self):
+            # Move the characters from the right of the locator to its
+            # left, in one edit.
+            self.splice(posl, posr + delta, self[posr:posr + delta] + locator)
+        elif delta < 0 and posl + delta >= 0:
+            self.splice(posl + delta, posr, locator + self[posl + delta:posl])
+        else:
+            self.splice(posl, posr, '')
+            posl = posl + delta
+            self.splice(posl, posl, locator)
 
     def slide_locator(self, locator, delta):
         """Slide the position of the given locator by the given delta.
@@ -234,7 +1586,24 @@ class MutableString(object):
         """
         a = self.pos_right(left, 0)
         b = self.pos_left(right, 0)
-        return self.string[a:b]
+        return self.store[a:b]
+
+    def read_tokens(self, left, right):
+        """Retrieve the substring between the two given locators as a
+        list of tokens, or None if the backing store does not keep track
+        of tokens or the substring does not consist of whole tokens.
+
+        >>> a = MutableString("This is (a)my (x)string(b) you know.", engine='token')
+        >>> print(a.read_tokens("(a)", "(b)"))
+        ['m', 'y', ' ', '(x)', 's', 't', 'r', 'i', 'n', 'g']
+        >>> a = MutableString("This is (a)my (x)string(b) you know.")
+        >>> print(a.read_tokens("(a)", "(b)"))
+        None
+
+        """
+        a = self.pos_right(left, 0)
+        b = self.pos_left(right, 0)
+        return self.store.tokens(a, b)
 
     def update(self, left, right, string):
         """Change the substring between the two given locators.
@@ -247,7 +1616,7 @@ class MutableString(object):
         """
         a = self.pos_right(left, 0)
         b = self.pos_left(right, 0)
-        self.set(self.string[:a] + str(string) + self.string[b:])
+        self.splice(a, b, str(string))
 
     def find_matching(self, pos):
         """Find the parenthesis which matches the parenthesis at the given
@@ -278,31 +1647,103 @@ class MutableString(object):
         True
 
         """
-        opener = self.string[pos]
-        if opener == u'(':
-            closer = u')'
-            dir = +1
-        elif opener == u')':
-            closer = u'('
-            dir = -1
-        else:
-            return None
-        level = 0
-        while pos < len(self.string):
-            if self.string[pos] == opener:
-                level += 1
-            elif self.string[pos] == closer:
-                level -= 1
-                if level == 0:
-                    return pos
-            pos += dir
-        return None
+        return self.store.find_matching(pos)
 
 
 class SlottedString(MutableString):
 
-    def __init__(self, initial):
-        super(SlottedString, self).__init__(initial)
+    def __init__(self, initial, **kwargs):
+        super(SlottedString, self).__init__(initial, **kwargs)
+        self.slot_names = {}
+        self.shortcuts = True
+
+    def set(self, string, index_state=None):
+        super(SlottedString, self).set(string, index_state=index_state)
+        self.slot_names = {}
+
+    def splice(self, start, end, string):
+        """Replace the characters between the two given positions with
+        the given string, forgetting any resolved slot names which the
+        change might affect.
+
+        Without a LocatorIndex to say which locators a change creates or
+        destroys, the names are forgotten only if the change might touch
+        a name slot, so most changes keep them.
+
+        >>> p = Semantics("(^`?)A(`?$)(^A)(A$)(^!)1(!$)" + "234" + "1234" * 49)
+        >>> hits = []
+        >>> get_slot_name = p.get_slot_name
+        >>> p.get_slot_name = lambda n: (hits.append(n in p.slot_names) or
+        ...                              get_slot_name(n))
+        >>> p.run()
+        RunResult('halted', steps=200)
+        >>> print(p.read_slot('A'))
+        4
+        >>> (hits.count(True), hits.count(False))
+        (599, 2)
+
+        """
+        (start, end, string) = self.resolve_splice(start, end, string)
+        delta = len(string) - (end - start)
+        for (name, span) in self.slot_names.values():
+            if span is None:
+                continue
+            if start <= span[1] and end >= span[0]:
+                self.slot_names = {}
+                break
+            if end < span[0]:
+                span[0] += delta
+                span[1] += delta
+        if (self.slot_names and self.index is None and
+            self.touches_name_slot(start, end, string)):
+            self.slot_names = {}
+        changed = super(SlottedString, self).splice(start, end, string)
+        if changed is not None and self.slot_names:
+            for locator in changed:
+                if locator.startswith(u"(^`") or locator.startswith(u"(`"):
+                    self.slot_names = {}
+                    break
+        return changed
+
+    def touches_name_slot(self, start, end, string):
+        """Return whether replacing the characters between the two given
+        positions with the given string might create or destroy the
+        locator of a name slot: whether there is a backtick in the
+        string, in the characters replaced, or in a locator which either
+        position falls inside.
+
+        >>> a = SlottedString("(^`P)Q(`P$)(^a)x(a$)")
+        >>> a.touches_name_slot(16, 17, "y"), a.touches_name_slot(5, 6, "R")
+        (False, False)
+        >>> a.touches_name_slot(2, 2, "Q"), a.touches_name_slot(10, 11, "")
+        (True, True)
+        >>> a.touches_name_slot(11, 11, "`"), a.touches_name_slot(1, 12, "")
+        (True, True)
+
+        """
+        if u'`' in string or u'`' in self[start:end]:
+            return True
+        store = self.store
+        # After end, the characters up to the next parenthesis are part
+        # of the locator end falls inside, if that parenthesis closes it.
+        closer = store.find(u')', end)
+        if closer >= 0:
+            opener = store.find(u'(', end)
+            if (opener < 0 or opener > closer) and u'`' in store[end:closer]:
+                return True
+        # Before start, the characters back to the last parenthesis are
+        # part of the locator start falls inside, before or after the
+        # change, if that parenthesis opens it.
+        (pos, size, seen) = (start, 64, False)
+        while pos > 0:
+            begin = max(pos - size, 0)
+            chunk = store[begin:pos]
+            found = max(chunk.rfind(u'('), chunk.rfind(u')'))
+            if found >= 0:
+                return chunk[found] == u'(' and (seen or u'`' in chunk[found:])
+            seen = seen or u'`' in chunk
+            (pos, size) = (begin, size * 2)
+        return False
 
     def read_slot(self, slot_name):
         """
@@ -375,14 +1816,48 @@ class SlottedString(MutableString):
         >>> print(a.get_slot_name('K'))
         Madge
 
+        Resolved names are cached until a change is made to a name slot,
+        or one is created or destroyed, unless shortcuts is false.  Along
+        with each name is kept the span of its name slot, which splice()
+        shifts to follow the changes before it.
+
+        >>> a.update_slot('`P', 'R')
+        >>> print(a.get_slot_name('P'))
+        R
+        >>> a.insert_locator('(^`M)(`M$)', 0)
+        >>> print(a.get_slot_name('M'))
+        None
+        >>> a.insert_locator('Jim', 5)
+        >>> print(a.get_slot_name('M'))
+        Jim
+        >>> a.remove_locator('(`P$)')
+        >>> print(a.get_slot_name('P'))
+        P
+
         """
+        if self.shortcuts:
+            try:
+                return self.slot_names[slot_name][0]
+            except KeyError:
+                pass
         name_slot = u"`%s" % slot_name
         try:
-            slot_name = self.read_slot(name_slot)
+            tokens = self.read_tokens(u"(^%s)" % name_slot, u"(%s$)" % name_slot)
         except (UndefinedLocatorError):
-            pass
-        slot_name = self.strip_all_locators(slot_name)
-        return slot_name
+            name = self.strip_all_locators(slot_name)
+            name_slot = None
+        else:
+            if tokens is None or '(' in tokens or ')' in tokens:
+                name = self.strip_all_locators(self.read_slot(name_slot))
+            else:
+                name = ''.join([token for token in tokens if len(token) == 1]) or None
+        if self.shortcuts:
+            span = None
+            if name_slot is not None:
+                span = [self.pos_right(u"(^%s)" % name_slot, 0),
+                        self.pos_left(u"(%s$)" % name_slot, 0)]
+            self.slot_names[slot_name] = (name, span)
+        return name
 
     def strip_all_locators(self, content):
         """
@@ -437,27 +1912,525 @@ class SlottedString(MutableString):
             self.slide_locator("(%s$)" % slot_name, delta)
 
 
+class BufferedOutput(object):
+    """File-like object which collects what is written to it and writes it
+    on to the given file in larger pieces: whenever size characters have
+    collected, or, if lines is given, whenever that many lines have, and
+    whenever it is flushed.
+
+    >>> from io import StringIO
+    >>> f = StringIO()
+    >>> b = BufferedOutput(f, size=10, lines=2)
+    >>> b.write("one\\n")
+    >>> f.getvalue()
+    ''
+    >>> b.write("two\\n")
+    >>> f.getvalue()
+    'one\\ntwo\\n'
+    >>> b.write("three, four\\n")
+    >>> b.write("five")
+    >>> f.getvalue()
+    'one\\ntwo\\nthree, four\\n'
+    >>> b.flush()
+    >>> f.getvalue()
+    'one\\ntwo\\nthree, four\\nfive'
+
+    """
+    def __init__(self, file, size=65536, lines=None):
+        self.file = file
+        self.size = size
+        self.lines = lines
+        self.pending = []
+        self.pending_size = 0
+        self.pending_lines = 0
+
+    def write(self, string):
+        self.pending.append(string)
+        self.pending_size += len(string)
+        self.pending_lines += string.count(u'\n')
+        if (self.pending_size >= self.size or
+            (self.lines is not None and self.pending_lines >= self.lines)):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write(u''.join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+            self.pending_lines = 0
+        flush = getattr(self.file, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+class BufferedInput(object):
+    """File-like object which reads lines from the given file, reading
+    ahead up to size characters, or bytes, at a time.  If the file has a
+    read1() method, as binary standard input does, only what is available
+    is read ahead, so that lines typed by a person are still read as soon
+    as they are typed.  Bytes are decoded as UTF-8.
+
+    >>> from io import BytesIO
+    >>> b = BufferedInput(BytesIO(u"one\\nt\\xe9o\\nthree".encode('utf-8')), size=4)
+    >>> b.readline()
+    'one\\n'
+    >>> b.readline() == u"t\\xe9o\\n"
+    True
+    >>> b.readline(), b.readline()
+    ('three', '')
+    >>> b = BufferedInput(BytesIO(u"\\xe9t\\xe9\\nsecond\\n".encode('utf-8')), size=1)
+    >>> b.readline() == u"\\xe9t\\xe9\\n"
+    True
+    >>> b.readline(), b.readline()
+    ('second\\n', '')
+
+    """
+    def __init__(self, file, size=65536):
+        import codecs
+        self.file = file
+        self.size = size
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def fill(self):
+        read = getattr(self.file, 'read1', None) or self.file.read
+        data = read(self.size)
+        if not data:
+            self.eof = True
+        if isinstance(data, bytes):
+            # Bytes holding only part of a character decode to nothing
+            # until the rest of it is read.
+            data = self.decoder.decode(data, final=self.eof)
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+
+    def readline(self):
+        while True:
+            end = self.buffer.find(u'\n', self.pos)
+            if end >= 0:
+                line = self.buffer[self.pos:end + 1]
+                self.pos = end + 1
+                return line
+            if self.eof:
+                line = self.buffer[self.pos:]
+                self.buffer = u''
+                self.pos = 0
+                return line
+            self.fill()
+
+
+class RunResult(object):
+    """The outcome of running a Program: why it stopped running (one of
+    HALTED, STEP_LIMIT, TIMEOUT or LOOP), the number of steps it executed,
+    and the number of seconds that took.
+
+    >>> r = RunResult(RunResult.TIMEOUT, 12, 0.5)
+    >>> r
+    RunResult('timeout', steps=12)
+    >>> r.halted
+    False
+
+    """
+    HALTED = 'halted'
+    STEP_LIMIT = 'step-limit'
+    TIMEOUT = 'timeout'
+    LOOP = 'loop'
+
+    def __init__(self, status, steps, elapsed):
+        self.status = status
+        self.steps = steps
+        self.elapsed = elapsed
+
+    @property
+    def halted(self):
+        return self.status == self.HALTED
+
+    def __repr__(self):
+        return "RunResult(%r, steps=%d)" % (self.status, self.steps)
+
+
+class Hook(object):
+    """A callback added to a Program by add_hook(), together with how
+    often, and for what, it is to be called.
+
+    """
+    def __init__(self, callback, every, only):
+        self.callback = callback
+        self.every = every
+        self.only = None if only is None else frozenset(only)
+        self.count = 0
+
+    def __call__(self, program, key, *args):
+        if self.only is not None and key not in self.only:
+            return
+        self.count += 1
+        if self.count % self.every == 0:
+            self.callback(program, *args)
+
+
 class Program(SlottedString):
+    OPCODES = {}
+    FAST_FORWARD_LIMIT = 4096
+    CHECKPOINT_EVERY = 5.0
 
-    def __init__(self, initial):
-        super(Program, self).__init__(initial)
+    def __init__(self, initial, **kwargs):
+        super(Program, self).__init__(initial, **kwargs)
         self.input = sys.stdin
         self.output = sys.stdout
+        self.steps = 0
+        self.input_lines = 0
+        self.fast_forward = False
+        self.checkpoint = None
+        self.checkpoint_every = self.CHECKPOINT_EVERY
+        self.hooks = {}
+        self.dispatch = self.build_dispatch()
+
+    def build_dispatch(self):
+        """Return a dictionary mapping each instruction in the OPCODES
+        table to the bound method which implements it, wrapped so as to
+        call the instruction hooks which apply to it, if there are any.
 
-    def load(self, filename):
-        """Load the program source from a Tranzy file."""
-        file = open(filename, 'r')
-        done = False
-        string = ''
-        for line in file.readlines():
-            if line.endswith('\n'):
-                line = line[:-1]
-            if line.startswith('#'):
-                pass
+        """
+        dispatch = {}
+        for (instruction, name) in self.OPCODES.items():
+            handler = getattr(self, name)
+            hooks = [hook for hook in self.hooks.get('instruction', [])
+                     if hook.only is None or instruction in hook.only]
+            if hooks:
+                handler = self.hooked_handler(handler, hooks)
+            dispatch[instruction] = handler
+        return dispatch
+
+    def hooked_handler(self, handler, hooks):
+        def hooked(instruction):
+            for hook in hooks:
+                hook(self, instruction, instruction)
+            handler(instruction)
+        return hooked
+
+    def add_hook(self, event, callback, every=1, only=None):
+        """Arrange for the given callback to be called whenever the given
+        event happens while this program runs.  The events are:
+
+        'step': after each step, as callback(program);
+        'instruction': before each instruction in the OPCODES table is
+        executed, as callback(program, instruction);
+        'slot-write': after each update_slot(), as
+        callback(program, slot_name, string).
+
+        If every is given, the callback is only called on every every'th
+        time the event happens.  If only is given, it must be a collection
+        of names, such as a list or set, of instructions, or slots, and the
+        callback is only called for instructions, or writes to slots, named
+        in it; it cannot be given for 'step'.  Hooks cost nothing until
+        one is added: the methods they observe are only wrapped then.
+        Step hooks are not called by step_n(), which does not call step().
+
+        >>> p = Semantics("(^?)(?$)(^!)1(!$)2345")
+        >>> p.add_hook('instruction', lambda p, i: print("exec " + i),
+        ...            only=['2', '4'])
+        >>> p.add_hook('step', lambda p: print(p.steps), every=2)
+        >>> p.add_hook('slot-write', lambda p, n, s: print(n + "=" + s), every=3)
+        >>> p.run()
+        exec 2
+        2
+        ?=3
+        exec 4
+        4
+        RunResult('halted', steps=5)
+        >>> p.clear_hooks()
+        >>> sorted(p.__dict__.keys()) == sorted(Semantics('').__dict__.keys())
+        True
+        >>> p.add_hook('step', lambda p: None, only=['1'])
+        Traceback (most recent call last):
+        ...
+        ValueError: only cannot be given for 'step'
+
+        """
+        if event not in ('step', 'instruction', 'slot-write'):
+            raise ValueError(event)
+        if event == 'step' and only is not None:
+            raise ValueError("only cannot be given for 'step'")
+        first = event not in self.hooks
+        self.hooks.setdefault(event, []).append(Hook(callback, every, only))
+        if event == 'instruction':
+            self.dispatch = self.build_dispatch()
+        elif event == 'step' and first:
+            step = self.step
+            hooks = self.hooks['step']
+
+            def hooked_step(limit=None):
+                result = step(limit)
+                if result:
+                    for hook in hooks:
+                        hook(self, None)
+                return result
+            self.step = hooked_step
+        elif event == 'slot-write' and first:
+            update_slot = self.update_slot
+            hooks = self.hooks['slot-write']
+
+            def hooked_update_slot(slot_name, string):
+                result = update_slot(slot_name, string)
+                for hook in hooks:
+                    hook(self, slot_name, slot_name, str(string))
+                return result
+            self.update_slot = hooked_update_slot
+
+    def clear_hooks(self):
+        """Remove all the hooks added to this program by add_hook()."""
+        if 'step' in self.hooks:
+            del self.step
+        if 'slot-write' in self.hooks:
+            del self.update_slot
+        self.hooks = {}
+        self.dispatch = self.build_dispatch()
+
+    ENCODING_RE = re.compile(r'coding[:=]\s*([-\w.]+)')
+
+    def load(self, source, encoding=None):
+        """Load the program source from a Tranzy file.
+
+        The source may be the name of a file, '-' for standard input, or
+        an open file object.  The file is read a line at a time.  Files
+        read as bytes are decoded with the given encoding, or, failing
+        that, the one named in an "encoding:" comment line, or, failing
+        that, UTF-8.
+
+        >>> from io import BytesIO
+        >>> p = Program('')
+        >>> p.load(BytesIO(u"# encoding: latin-1\\n(^?)caf\\xe9(?$)\\n".encode('latin-1')))
+        >>> print(p.read_slot('?') == u"caf\\xe9")
+        True
+        >>> p.load(BytesIO(u"(^?)caf\\xe9\\n(?$)\\n# ok\\n".encode('utf-8')))
+        >>> print(p.read_slot('?') == u"caf\\xe9")
+        True
+        >>> from io import StringIO
+        >>> p.load(StringIO(u"#!/usr/bin/pophery\\n(^!)0\\n(!$)X"))
+        >>> print(str(p))
+        (^!)0(!$)X
+        >>> p.load(BytesIO(b"(^?)Hi(?$)\\r\\n(^!)O(!$)\\r\\n"))
+        >>> print(repr(str(p)))
+        '(^?)Hi(?$)(^!)O(!$)'
+
+        """
+        if hasattr(source, 'readline'):
+            self.load_lines(source, encoding)
+        elif source == '-':
+            self.load_lines(getattr(sys.stdin, 'buffer', sys.stdin), encoding)
+        else:
+            file = open(source, 'rb')
+            try:
+                self.load_lines(file, encoding)
+            finally:
+                file.close()
+
+    def load_lines(self, file, encoding):
+        """Load the program source from the lines of an open Tranzy file."""
+        lines = []
+        for line in file:
+            if isinstance(line, bytes):
+                comment = line.startswith(b'#')
+                newlines = (b'\r\n', b'\n')
+            else:
+                comment = line.startswith(u'#')
+                newlines = (u'\r\n', u'\n')
+            if comment:
+                if encoding is None:
+                    if isinstance(line, bytes):
+                        line = line.decode('ascii', 'replace')
+                    match = self.ENCODING_RE.search(line)
+                    if match:
+                        encoding = match.group(1)
             else:
-                string += line
+                for newline in newlines:
+                    if line.endswith(newline):
+                        line = line[:-len(newline)]
+                        break
+                lines.append(line)
+        if lines and isinstance(lines[0], bytes):
+            string = b''.join(lines).decode(encoding or 'utf-8')
+        else:
+            string = u''.join(lines)
         self.set(string)
-        file.close()
+
+    SNAPSHOT_MAGIC = b"#pophery-snapshot\n"
+    SNAPSHOT_SUFFIX = 'c'
+    SNAPSHOT_VERSION = 1
+
+    def save_snapshot(self, filename, source=None, checkpoint=None):
+        """Write this program to a snapshot file, which load_snapshot() can
+        load faster than load() can load a Tranzy file.
+
+        A snapshot file consists of a line identifying it, a line of JSON
+        giving the snapshot format version, the engine, the length of the
+        program, the locator index (if this program is indexed), the
+        modification time and size of the source file (if one is given),
+        and the given checkpoint (if any; see save_checkpoint()), followed
+        by the program itself, encoded as UTF-8.
+
+        """
+        header = {
+            'version': self.SNAPSHOT_VERSION,
+            'engine': self.engine,
+            'length': len(self),
+        }
+        if source is not None:
+            stat = os.stat(source)
+            header['source'] = {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+        if checkpoint is not None:
+            header['checkpoint'] = checkpoint
+        if self.index is not None:
+            header['index'] = self.index.state()
+        file = open(filename, 'wb')
+        try:
+            file.write(self.SNAPSHOT_MAGIC)
+            file.write(json.dumps(header).encode('utf-8') + b'\n')
+            file.write(str(self).encode('utf-8'))
+        finally:
+            file.close()
+
+    def load_snapshot(self, filename, source=None):
+        """Load the program from a snapshot file written by save_snapshot()
+        and return True, or, if the snapshot is not usable, leave the
+        program as it was and return False.
+
+        A snapshot is not usable if it was written in another version of
+        the format, or if a source file is given and has been modified
+        since the snapshot was written from it.
+
+        >>> import os, tempfile
+        >>> (fd, source) = tempfile.mkstemp()
+        >>> n = os.write(fd, b"(^?)Hi(?$)(^!)O(!$)")
+        >>> os.close(fd)
+        >>> p = Semantics('', indexed=True)
+        >>> p.load(source)
+        >>> p.save_snapshot(source + 'c', source=source)
+        >>> q = Semantics('', engine='rope', indexed=True)
+        >>> q.load_snapshot(source + 'c', source=source)
+        True
+        >>> print(str(q))
+        (^?)Hi(?$)(^!)O(!$)
+        >>> q.index.state() == p.index.state()
+        True
+        >>> n = open(source, 'a').write("O")
+        >>> q.load_snapshot(source + 'c', source=source)
+        False
+        >>> os.unlink(source)
+        >>> os.unlink(source + 'c')
+
+        """
+        (header, string) = self.read_snapshot(filename)
+        if header is None:
+            return False
+        if source is not None:
+            stat = os.stat(source)
+            if header.get('source') != {'mtime': stat.st_mtime_ns,
+                                        'size': stat.st_size}:
+                return False
+        self.set(string, index_state=header.get('index'))
+        return True
+
+    def read_snapshot(self, filename):
+        """Return the header and the program read from the snapshot file
+        with the given name, or (None, None) if it is not a complete
+        snapshot in this version of the format.
+
+        """
+        file = open(filename, 'rb')
+        try:
+            if file.readline() != self.SNAPSHOT_MAGIC:
+                return (None, None)
+            header = json.loads(file.readline().decode('utf-8'))
+            if header.get('version') != self.SNAPSHOT_VERSION:
+                return (None, None)
+            string = file.read().decode('utf-8')
+        finally:
+            file.close()
+        if len(string) != header['length']:
+            return (None, None)
+        return (header, string)
+
+    def save_checkpoint(self, filename):
+        """Write the state of this running program to a checkpoint file,
+        from which resume() can continue running it.
+
+        A checkpoint is a snapshot whose header also gives the number of
+        steps executed, the number of lines of input read, and any output
+        which has been written but is still waiting in a BufferedOutput.
+        It is written to a temporary file which then replaces the named
+        file, so that a crash while writing it leaves the last one intact.
+
+        """
+        pending = getattr(self.output, 'pending', None) or []
+        checkpoint = {
+            'steps': self.steps,
+            'input_lines': self.input_lines,
+            'output': u''.join(pending),
+        }
+        temporary = filename + '.tmp'
+        self.save_snapshot(temporary, checkpoint=checkpoint)
+        os.replace(temporary, filename)
+
+    def resume(self, filename):
+        """Restore the state of a running program from a checkpoint file
+        written by save_checkpoint() and return True, or, if the file is
+        not a usable checkpoint, leave the program as it was and return
+        False.
+
+        The lines of input which had been read are read again, and
+        skipped, so the same input should be given; the output which was
+        waiting is written again.
+
+        >>> import os, tempfile
+        >>> from io import StringIO
+        >>> (fd, checkpoint) = tempfile.mkstemp()
+        >>> os.close(fd)
+        >>> p = Semantics("(^?)(?$)(^!)I(!$)OIO")
+        >>> p.input = StringIO(u"one\\ntwo\\n")
+        >>> p.output = BufferedOutput(StringIO())
+        >>> p.run(max_steps=2)
+        RunResult('step-limit', steps=2)
+        >>> p.output.write(u"waiting\\n")
+        >>> p.save_checkpoint(checkpoint)
+        >>> q = Semantics('')
+        >>> q.input = StringIO(u"one\\ntwo\\n")
+        >>> q.resume(checkpoint)
+        waiting
+        True
+        >>> q.run()
+        two
+        RunResult('halted', steps=2)
+        >>> print(str(q))
+        (^?)two(?$)IOIO(^!)(!$)
+        >>> os.unlink(checkpoint)
+
+        """
+        (header, string) = self.read_snapshot(filename)
+        if header is None or 'checkpoint' not in header:
+            return False
+        checkpoint = header['checkpoint']
+        self.set(string, index_state=header.get('index'))
+        self.steps = checkpoint['steps']
+        for i in range(checkpoint['input_lines']):
+            self.input.readline()
+        self.input_lines = checkpoint['input_lines']
+        if checkpoint['output']:
+            self.output.write(checkpoint['output'])
+        return True
+
+    def load_compiled(self, filename, encoding=None):
+        """Load the program from the Tranzy file with the given name, or,
+        if there is an up-to-date snapshot of it, written by --compile,
+        from that instead.
+
+        """
+        snapshot = filename + self.SNAPSHOT_SUFFIX
+        if os.path.exists(snapshot) and self.load_snapshot(snapshot, source=filename):
+            return
+        self.load(filename, encoding=encoding)
 
     def advance(self):
         """Slide the instruction slot rightward.
@@ -522,346 +2495,887 @@ class Program(SlottedString):
                     return None
             return instruction[pos]
     
-    def execute(self, instruction):
-        raise NotImplementedError
-
-    def step(self):
-        """Execute one step of this Pophery program."""
-        instruction = self.read_slot(self.get_slot_name('!'))
-        instruction = self.clean_instruction(instruction)
-        if instruction is None:
-            return False
-        else:
-            self.execute(instruction)
-            self.advance()
-            return True
-
-    def run(self):
-        """Execute this Pophery program and return only when it terminates."""
-        keep_going = self.step()
-        while keep_going:
-            keep_going = self.step()
+    def current_instruction(self):
+        """Return the current instruction, or None if the contents of the
+        instruction slot have no characters apart from locators.
 
+        >>> p = Program("(^!)(^8)(^7)(7$)CAT(8$)(!$)")
+        >>> print(p.current_instruction())
+        C
+        >>> p = Program("(^!)(^8)(^7)(7$)CAT(8$)(!$)", engine='token')
+        >>> print(p.current_instruction())
+        C
+        >>> p = Program("(^!)((!$)", engine='token')
+        >>> print(p.current_instruction())
+        None
 
-class Semantics(Program):
-    def deselect(self):
-        locator_name = self.get_slot_name('/')
-        try:
-            self.remove_locator('(^%s)' % locator_name)
-        except UndefinedLocatorError:
-            pass
-        try:
-            self.remove_locator('(%s$)' % locator_name)
-        except UndefinedLocatorError:
-            pass
+        """
+        slot_name = self.get_slot_name('!')
+        tokens = self.read_tokens(u"(^%s)" % slot_name, u"(%s$)" % slot_name)
+        if tokens is None:
+            return self.clean_instruction(self.read_slot(slot_name))
+        for token in tokens:
+            if token == '(':
+                return None
+            if len(token) == 1:
+                return token
+        return None
 
     def execute(self, instruction):
         """Apply the semantics of the given instruction to this Program.
 
-        * 0 through 9 update the accumulator to the literal strings 0 through
-          9, respectively.
+        The semantics are looked up in the OPCODES table of the class,
+        which maps each instruction to the name of the method which
+        implements it.  That method is called with the instruction.
+        Instructions which do not appear in the table do nothing.
+        Subclasses can add instructions, or change what they do, by
+        extending the table:
+
+        >>> class Shouty(Program):
+        ...     OPCODES = {'!': 'op_shout'}
+        ...     def op_shout(self, instruction):
+        ...         print("HEY" + instruction)
+        >>> class Shoutier(Shouty):
+        ...     OPCODES = dict(Shouty.OPCODES, **{'?': 'op_shout'})
+        >>> p = Shoutier("")
+        >>> p.execute('!')
+        HEY!
+        >>> p.execute('?')
+        HEY?
+        >>> p.execute('.')
 
-        >>> p = Semantics("(^?)(?$)")
-        >>> p.execute('0')
-        >>> print(str(p))
-        (^?)0(?$)
-
-        * X ("cut") erases (updates with the zero-length string) the selection.
-
-        >>> p = Semantics("(^/)hi(/$)")
-        >>> p.execute('X')
+        """
+        handler = self.dispatch.get(instruction)
+        if handler is not None:
+            handler(instruction)
+
+    def skip_noops(self, limit=None):
+        """Execute a run of steps whose instructions do nothing, all in
+        one edit, and return the number of steps so executed.  If limit
+        is given, no more than that many steps are executed.
+
+        This is possible when the instruction slot contains a single
+        character which is not in the OPCODES table, and is followed by
+        characters which are not parentheses; the instruction slot slides
+        over them until it contains an instruction which is in the table.
+        If fewer than two steps could be executed this way, nothing is
+        done, and 0 is returned.
+
+        >>> p = Semantics("(^?)Hi(?$)(^!)a(!$)bc O(^x)")
+        >>> p.skip_noops()
+        4
         >>> print(str(p))
-        (^/)(/$)
-        >>> p = Semantics("(^`/)X(`/$)(^X)hi(X$)")
-        >>> p.execute('X')
+        (^?)Hi(?$)abc (^!)O(!$)(^x)
+        >>> p.skip_noops()
+        0
+        >>> p = Semantics("(^!)a(!$)bcd")
+        >>> p.skip_noops(limit=2)
+        2
         >>> print(str(p))
-        (^`/)X(`/$)(^X)(X$)
+        ab(^!)c(!$)d
 
-        * C ("copy") updates the contents of the clipboard with the contents
-          of the selection.
+        """
+        slot_name = self.get_slot_name('!')
+        left = u"(^%s)" % slot_name
+        right = u"(%s$)" % slot_name
+        start = self.pos_left(left, 0)
+        pos = self.pos_left(right, 0)
+        if pos != start + len(left) + 1:
+            return 0
+        instruction = self[pos - 1]
+        if instruction in u'()' or instruction in self.dispatch:
+            return 0
+        end = pos + len(right)
+        following = self[end:end + self.FAST_FORWARD_LIMIT]
+        count = 0
+        for char in following:
+            if char in u'()' or count == limit:
+                break
+            count += 1
+            if char in self.dispatch:
+                break
+        if count < 2:
+            return 0
+        self.splice(start, end + count,
+                    instruction + following[:count - 1] + left +
+                    following[count - 1] + right)
+        return count
+
+    def step(self, limit=None):
+        """Execute one step of this Pophery program.
 
-        >>> p = Semantics("(^/)hi(/$)(^%)lo(%$)")
-        >>> p.execute('C')
-        >>> print(str(p))
-        (^/)hi(/$)(^%)hi(%$)
-        >>> p = Semantics("(^/)hi(/$)(^J)lo(J$)(^`%)J(`%$)")
-        >>> p.execute('C')
+        If fast_forward is set, a run of steps whose instructions do
+        nothing may be executed as a single step, of no more than limit
+        steps if limit is given; see skip_noops().  Either way, steps
+        counts the number of steps executed.
+
+        >>> p = Semantics("(^?)Hi(?$)(^!)O(!$) nice (^t)(t$)day O")
+        >>> p.fast_forward = True
+        >>> while p.step():
+        ...     print(p.steps)
+        Hi
+        1
+        6
+        7
+        8
+        11
+        Hi
+        12
         >>> print(str(p))
-        (^/)hi(/$)(^J)hi(J$)(^`%)J(`%$)
+        (^?)Hi(?$)O nice (^t)(t$)day O(^!)(!$)
 
-        * V ("paste") updates the contents of the selection with the contents
-          of the clipboard.
-
-        >>> p = Semantics("(^/)hi(/$)(^%)lo(%$)")
-        >>> p.execute('V')
-        >>> print(str(p))
-        (^/)lo(/$)(^%)lo(%$)
-        >>> p = Semantics("(^C)lo(C$)(^J)hi(J$)(^`/)J(`/$)(^`%)C(`%$)")
-        >>> p.execute('V')
+        """
+        instruction = self.current_instruction()
+        if instruction is None:
+            return False
+        if self.fast_forward and instruction not in self.dispatch:
+            count = self.skip_noops(limit)
+            if count > 0:
+                self.steps += count
+                return True
+        self.execute(instruction)
+        self.advance()
+        self.steps += 1
+        return True
+
+    def step_n(self, n):
+        """Execute at most n steps of this Pophery program, stopping early
+        if it terminates, and return the number of steps executed.
+
+        This does the same thing as calling step() n times, but does it
+        in a single loop; execute() and step() are not called, so
+        overriding them in a subclass has no effect here.  Unlike step(),
+        a fast-forwarded run of steps never carries past the n'th step.
+
+        >>> p = Semantics("(^?)Hi(?$)(^!)O(!$)xyzO")
+        >>> p.step_n(2)
+        Hi
+        2
         >>> print(str(p))
-        (^C)lo(C$)(^J)lo(J$)(^`/)J(`/$)(^`%)C(`%$)
-
-        * S ("select") selects the contents of the slot indirect by the
-          accumulator.
+        (^?)Hi(?$)Ox(^!)y(!$)zO
+        >>> p.fast_forward = True
+        >>> p.step_n(10)
+        Hi
+        3
+        >>> print(p.steps)
+        5
 
-        >>> p = Semantics("(^/)foo(/$)(^?)A(?$)(^A)Some text.(A$)")
-        >>> p.execute('S')
-        >>> print(str(p))
-        foo(^?)A(?$)(^A)(^/)Some text.(/$)(A$)
-        >>> p = Semantics("(^`/)k(`/$)(^k)foo(k$)(^?)A(?$)(^A)Some text.(A$)")
-        >>> p.execute('S')
+        """
+        current_instruction = self.current_instruction
+        dispatch = self.dispatch
+        advance = self.advance
+        fast_forward = self.fast_forward
+        start = self.steps
+        stop = start + n
+        while self.steps < stop:
+            instruction = current_instruction()
+            if instruction is None:
+                break
+            handler = dispatch.get(instruction)
+            if handler is not None:
+                handler(instruction)
+            elif fast_forward:
+                count = self.skip_noops(stop - self.steps)
+                if count > 0:
+                    self.steps += count
+                    continue
+            advance()
+            self.steps += 1
+        return self.steps - start
+
+    def run(self, max_steps=None, deadline=None):
+        """Execute this Pophery program and return only when it terminates,
+        or when it has executed max_steps steps, or when the time, as given
+        by time.time(), reaches deadline, whichever comes first.  Return a
+        RunResult saying which it was.
+
+        A fast-forwarded step counts as all of the steps it skips, and
+        never skips past max_steps.
+
+        If checkpoint is set to the name of a file, a checkpoint is written
+        to it every checkpoint_every seconds, and when the run stops
+        without an exception.
+
+        >>> p = Semantics("(^?)Hi(?$)(^!)O(!$)OO")
+        >>> p.run(max_steps=2)
+        Hi
+        Hi
+        RunResult('step-limit', steps=2)
+        >>> p.run()
+        Hi
+        RunResult('halted', steps=1)
+        >>> p.run(deadline=time.time() - 1)
+        RunResult('timeout', steps=0)
         >>> print(str(p))
-        (^`/)k(`/$)foo(^?)A(?$)(^A)(^k)Some text.(k$)(A$)
+        (^?)Hi(?$)OOO(^!)(!$)
+        >>> p = Semantics("(^!)a(!$)" + "b" * 100 + "O")
+        >>> p.fast_forward = True
+        >>> p.run(max_steps=2)
+        RunResult('step-limit', steps=2)
 
-        * A ("select all") selects the contents of the accumulator.
-
-        >>> p = Semantics("(^/)foo(/$)(^?)A(?$)(^A)Some text.(A$)")
-        >>> p.execute('A')
-        >>> print(str(p))
-        foo(^?)(^/)A(/$)(?$)(^A)Some text.(A$)
-        >>> p = Semantics("(^`/)r(`/$)(^r)foo(r$)(^?)A(?$)(^A)Some text.(A$)")
-        >>> p.execute('A')
-        >>> print(str(p))
-        (^`/)r(`/$)foo(^?)(^r)A(r$)(?$)(^A)Some text.(A$)
+        """
+        start = self.steps
+        started = time.time()
+        status = RunResult.HALTED
+        checkpoint = self.checkpoint
+        if checkpoint is not None:
+            next_checkpoint = started + self.checkpoint_every
+        try:
+            while True:
+                if max_steps is not None and self.steps - start >= max_steps:
+                    status = RunResult.STEP_LIMIT
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    status = RunResult.TIMEOUT
+                    break
+                if checkpoint is not None and time.time() >= next_checkpoint:
+                    self.save_checkpoint(checkpoint)
+                    next_checkpoint = time.time() + self.checkpoint_every
+                if max_steps is None:
+                    limit = None
+                else:
+                    limit = max_steps - (self.steps - start)
+                if not self.step(limit):
+                    break
+        finally:
+            self.flush_output()
+        if checkpoint is not None:
+            self.save_checkpoint(checkpoint)
+        return RunResult(status, self.steps - start, time.time() - started)
+
+    async def run_async(self, input=None, output=None, yield_every=100,
+                        max_steps=None, deadline=None):
+        """Execute this Pophery program as a coroutine, returning a
+        RunResult as run() does, and yielding to the event loop after
+        every yield_every steps.
+
+        If input is given, each line of input is awaited from its
+        readline() coroutine; if output is given, everything the program
+        outputs in a step is written to its write() method, which is
+        awaited if it returns an awaitable, and then its drain()
+        coroutine is awaited, if it has one.  Bytes read are decoded
+        as UTF-8.
+
+        >>> import asyncio
+        >>> class Lines(object):
+        ...     def __init__(self, lines):
+        ...         self.queue = asyncio.Queue()
+        ...         for line in lines:
+        ...             self.queue.put_nowait(line)
+        ...     async def readline(self):
+        ...         return await self.queue.get()
+        >>> class Sink(object):
+        ...     async def write(self, string):
+        ...         print("got %r" % string)
+        >>> async def session(lines):
+        ...     p = Semantics("(^?)(?$)(^!)I(!$)OIO")
+        ...     return await p.run_async(input=Lines(lines), output=Sink(),
+        ...                              yield_every=1)
+        >>> async def both():
+        ...     return await asyncio.gather(session([b"one\\n", b"two\\n"]),
+        ...                                 session([u"three\\n", u""]))
+        >>> asyncio.run(both())
+        got 'one\\n'
+        got 'three\\n'
+        got 'two\\n'
+        got '\\n'
+        [RunResult('halted', steps=4), RunResult('halted', steps=4)]
 
-        * L ("left") slides the left locator of the selection leftward.
+        """
+        import asyncio
+        import inspect
+        from io import StringIO
+        saved = (self.input, self.output)
+        collected = StringIO()
+        if output is not None:
+            self.output = collected
+        start = self.steps
+        started = time.time()
+        status = RunResult.HALTED
+        try:
+            while True:
+                if max_steps is not None and self.steps - start >= max_steps:
+                    status = RunResult.STEP_LIMIT
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    status = RunResult.TIMEOUT
+                    break
+                if input is not None:
+                    instruction = self.current_instruction()
+                    if self.OPCODES.get(instruction) == 'op_input':
+                        line = await input.readline()
+                        if isinstance(line, bytes):
+                            line = line.decode('utf-8')
+                        self.input = StringIO(line)
+                before = self.steps
+                if max_steps is None:
+                    limit = None
+                else:
+                    limit = max_steps - (self.steps - start)
+                keep_going = self.step(limit)
+                if output is not None and collected.tell() > 0:
+                    result = output.write(collected.getvalue())
+                    if inspect.isawaitable(result):
+                        await result
+                    drain = getattr(output, 'drain', None)
+                    if drain is not None:
+                        await drain()
+                    collected.seek(0)
+                    collected.truncate()
+                if not keep_going:
+                    break
+                if (self.steps - start) // yield_every != (before - start) // yield_every:
+                    await asyncio.sleep(0)
+        finally:
+            self.flush_output()
+            (self.input, self.output) = saved
+        return RunResult(status, self.steps - start, time.time() - started)
+
+    def flush_output(self):
+        """Flush this program's output, if it can be flushed.  run() and
+        run_async() do this whenever they return, or raise an exception.
 
-        >>> p = Semantics("foo(^/)bar(/$)")
-        >>> p.execute('L')
-        >>> print(str(p))
-        fo(^/)obar(/$)
-        >>> p = Semantics("(^/)foobar(/$)")
-        >>> p.execute('L')
-        >>> print(str(p))
-        (^/)foobar(/$)
-        >>> p = Semantics("foo(^C)bar(C$)(^`/)C(`/$)")
-        >>> p.execute('L')
-        >>> print(str(p))
-        fo(^C)obar(C$)(^`/)C(`/$)
-        >>> p = Semantics("The last time I saw Charlie")
-        >>> p.execute('L')
+        >>> from io import StringIO
+        >>> p = Semantics("(^?)Hi(?$)(^!)OO(!$)I")
+        >>> p.output = BufferedOutput(StringIO())
+        >>> p.input = None
+        >>> p.run()
         Traceback (most recent call last):
         ...
-        UndefinedLocatorError: (^/)
+        AttributeError: 'NoneType' object has no attribute 'readline'
+        >>> print(p.output.file.getvalue().strip())
+        Hi
+        Hi
+        >>> import asyncio
+        >>> p = Semantics("(^?)Hi(?$)(^!)O(!$)")
+        >>> p.output = BufferedOutput(StringIO())
+        >>> asyncio.run(p.run_async())
+        RunResult('halted', steps=1)
+        >>> print(p.output.file.getvalue().strip())
+        Hi
 
-        * R ("right") slides the left locator of the selection rightward.
+        """
+        flush = getattr(self.output, 'flush', None)
+        if flush is not None:
+            flush()
 
-        >>> p = Semantics("foo(^/)bar(/$)")
-        >>> p.execute('R')
-        >>> print(str(p))
-        foob(^/)ar(/$)
-        >>> p = Semantics("foo(^/)(/$)bar")
-        >>> p.execute('R')
-        >>> print(str(p))
-        foo(^/)(/$)bar
-        >>> p = Semantics("foo(^C)bar(C$)(^`/)C(`/$)")
-        >>> p.execute('R')
-        >>> print(str(p))
-        foob(^C)ar(C$)(^`/)C(`/$)
-        >>> p = Semantics("The last time I saw Charlie")
-        >>> p.execute('R')
-        Traceback (most recent call last):
-        ...
-        UndefinedLocatorError: (^/)
 
-        * E ("end") moves the left locator of the selection to immediately
-          to the left of the right locator of the selection, resulting in
-          the selection containing the zero-length string.
+class Semantics(Program):
+    """The semantics of the Pophery instructions, which execute() applies
+    to this Program.
+
+    * 0 through 9 update the accumulator to the literal strings 0 through
+      9, respectively.
+
+    >>> p = Semantics("(^?)(?$)")
+    >>> p.execute('0')
+    >>> print(str(p))
+    (^?)0(?$)
+
+    * X ("cut") erases (updates with the zero-length string) the selection.
+
+    >>> p = Semantics("(^/)hi(/$)")
+    >>> p.execute('X')
+    >>> print(str(p))
+    (^/)(/$)
+    >>> p = Semantics("(^`/)X(`/$)(^X)hi(X$)")
+    >>> p.execute('X')
+    >>> print(str(p))
+    (^`/)X(`/$)(^X)(X$)
+
+    * C ("copy") updates the contents of the clipboard with the contents
+      of the selection.
+
+    >>> p = Semantics("(^/)hi(/$)(^%)lo(%$)")
+    >>> p.execute('C')
+    >>> print(str(p))
+    (^/)hi(/$)(^%)hi(%$)
+    >>> p = Semantics("(^/)hi(/$)(^J)lo(J$)(^`%)J(`%$)")
+    >>> p.execute('C')
+    >>> print(str(p))
+    (^/)hi(/$)(^J)hi(J$)(^`%)J(`%$)
+
+    * V ("paste") updates the contents of the selection with the contents
+      of the clipboard.
+
+    >>> p = Semantics("(^/)hi(/$)(^%)lo(%$)")
+    >>> p.execute('V')
+    >>> print(str(p))
+    (^/)lo(/$)(^%)lo(%$)
+    >>> p = Semantics("(^C)lo(C$)(^J)hi(J$)(^`/)J(`/$)(^`%)C(`%$)")
+    >>> p.execute('V')
+    >>> print(str(p))
+    (^C)lo(C$)(^J)lo(J$)(^`/)J(`/$)(^`%)C(`%$)
+
+    * S ("select") selects the contents of the slot indirect by the
+      accumulator.
+
+    >>> p = Semantics("(^/)foo(/$)(^?)A(?$)(^A)Some text.(A$)")
+    >>> p.execute('S')
+    >>> print(str(p))
+    foo(^?)A(?$)(^A)(^/)Some text.(/$)(A$)
+    >>> p = Semantics("(^`/)k(`/$)(^k)foo(k$)(^?)A(?$)(^A)Some text.(A$)")
+    >>> p.execute('S')
+    >>> print(str(p))
+    (^`/)k(`/$)foo(^?)A(?$)(^A)(^k)Some text.(k$)(A$)
+
+    * A ("select all") selects the contents of the accumulator.
+
+    >>> p = Semantics("(^/)foo(/$)(^?)A(?$)(^A)Some text.(A$)")
+    >>> p.execute('A')
+    >>> print(str(p))
+    foo(^?)(^/)A(/$)(?$)(^A)Some text.(A$)
+    >>> p = Semantics("(^`/)r(`/$)(^r)foo(r$)(^?)A(?$)(^A)Some text.(A$)")
+    >>> p.execute('A')
+    >>> print(str(p))
+    (^`/)r(`/$)foo(^?)(^r)A(r$)(?$)(^A)Some text.(A$)
+
+    * L ("left") slides the left locator of the selection leftward.
+
+    >>> p = Semantics("foo(^/)bar(/$)")
+    >>> p.execute('L')
+    >>> print(str(p))
+    fo(^/)obar(/$)
+    >>> p = Semantics("(^/)foobar(/$)")
+    >>> p.execute('L')
+    >>> print(str(p))
+    (^/)foobar(/$)
+    >>> p = Semantics("foo(^C)bar(C$)(^`/)C(`/$)")
+    >>> p.execute('L')
+    >>> print(str(p))
+    fo(^C)obar(C$)(^`/)C(`/$)
+    >>> p = Semantics("The last time I saw Charlie")
+    >>> p.execute('L')
+    Traceback (most recent call last):
+    ...
+    UndefinedLocatorError: (^/)
+
+    * R ("right") slides the left locator of the selection rightward.
+
+    >>> p = Semantics("foo(^/)bar(/$)")
+    >>> p.execute('R')
+    >>> print(str(p))
+    foob(^/)ar(/$)
+    >>> p = Semantics("foo(^/)(/$)bar")
+    >>> p.execute('R')
+    >>> print(str(p))
+    foo(^/)(/$)bar
+    >>> p = Semantics("foo(^C)bar(C$)(^`/)C(`/$)")
+    >>> p.execute('R')
+    >>> print(str(p))
+    foob(^C)ar(C$)(^`/)C(`/$)
+    >>> p = Semantics("The last time I saw Charlie")
+    >>> p.execute('R')
+    Traceback (most recent call last):
+    ...
+    UndefinedLocatorError: (^/)
+
+    * E ("end") moves the left locator of the selection to immediately
+      to the left of the right locator of the selection, resulting in
+      the selection containing the zero-length string.
+
+    >>> p = Semantics("foo(^/)bar(/$)baz")
+    >>> p.execute('E')
+    >>> print(str(p))
+    foobar(^/)(/$)baz
+    >>> p = Semantics("foo(^a)b(^`/)a(`/$)r(a$)baz")
+    >>> p.execute('E')
+    >>> print(str(p))
+    foob(^`/)a(`/$)r(^a)(a$)baz
+    >>> p = Semantics("The last time I saw Charlie")
+    >>> p.execute('E')
+    Traceback (most recent call last):
+    ...
+    UndefinedLocatorError: (^/)
+
+    * F ("find") searches everywhere in the contents of the accumulator
+      for the contents of the clipboard. If found, that substring is
+      selected.
+
+    >>> p = Semantics("(^?)By hook or by crook, we will.(?$)(^%)ook(%$)")
+    >>> p.execute('F')
+    >>> print(str(p))
+    (^?)By h(^/)ook(/$) or by crook, we will.(?$)(^%)ook(%$)
+
+    * D ("drag-and-drop") moves the selection to the accumulator.
+
+    >>> p = Semantics("(^/)hi(/$)(^?)lo(?$)")
+    >>> p.execute('D')
+    >>> print(str(p))
+    hi(^?)(^/)hi(/$)(?$)
+    >>> p = Semantics("(^C)lo(C$)(^J)hi(J$)(^`/)J(`/$)(^`?)C(`?$)")
+    >>> p.execute('D')
+    >>> print(str(p))
+    (^C)(^J)hi(J$)(C$)hi(^`/)J(`/$)(^`?)C(`?$)
+
+    * I ("input") waits for a line to appear on standard input, then
+      places it (sans newline) in the accumulator.
+
+    >>> from io import StringIO
+    >>> p = Semantics("(^?)(?$)")
+    >>> p.input = StringIO(chr(10).join(["Line.", "Line!", "LINE!"]))
+    >>> p.execute('I')
+    >>> print(str(p))
+    (^?)Line.(?$)
+    >>> p.execute('I')
+    >>> print(str(p))
+    (^?)Line!(?$)
+    >>> p.execute('I')
+    >>> print(str(p))
+    (^?)LINE!(?$)
+    >>> p.execute('I')
+    >>> print(str(p))
+    (^?)(?$)
+
+    * O ("output") outputs the string in the accumulator to standard
+      output, followed by a newline.
+
+    >>> p = Semantics("(^?)Hello, world!(?$)")
+    >>> p.execute('O')
+    Hello, world!
+    >>> print(str(p))
+    (^?)Hello, world!(?$)
 
-        >>> p = Semantics("foo(^/)bar(/$)baz")
-        >>> p.execute('E')
-        >>> print(str(p))
-        foobar(^/)(/$)baz
-        >>> p = Semantics("foo(^a)b(^`/)a(`/$)r(a$)baz")
-        >>> p.execute('E')
-        >>> print(str(p))
-        foob(^`/)a(`/$)r(^a)(a$)baz
-        >>> p = Semantics("The last time I saw Charlie")
-        >>> p.execute('E')
-        Traceback (most recent call last):
-        ...
-        UndefinedLocatorError: (^/)
+    Now we demonstrate some idioms.
 
-        * F ("find") searches everywhere in the contents of the accumulator
-          for the contents of the clipboard. If found, that substring is
-          selected.
+    Assume the inital program defines some slots to contain initial
+    data.  That data can then be loaded into the accumulator:
 
-        >>> p = Semantics("(^?)By hook or by crook, we will.(?$)(^%)ook(%$)")
-        >>> p.execute('F')
-        >>> print(str(p))
-        (^?)By h(^/)ook(/$) or by crook, we will.(?$)(^%)ook(%$)
+    >>> p = Semantics("(^0)data(0$)(^%)(%$)(^?)(?$)(^!)0(!$)SCAV")
+    >>> p.run()
+    RunResult('halted', steps=5)
+    >>> print(str(p))
+    (^0)data(0$)(^%)data(%$)(^?)(^/)data(/$)(?$)0SCAV(^!)(!$)
 
-        * D ("drag-and-drop") moves the selection to the accumulator.
+    New data, say the literal string 1, can be stored into slot 0 with:
 
-        >>> p = Semantics("(^/)hi(/$)(^?)lo(?$)")
-        >>> p.execute('D')
-        >>> print(str(p))
-        hi(^?)(^/)hi(/$)(?$)
-        >>> p = Semantics("(^C)lo(C$)(^J)hi(J$)(^`/)J(`/$)(^`?)C(`?$)")
-        >>> p.execute('D')
-        >>> print(str(p))
-        (^C)(^J)hi(J$)(C$)hi(^`/)J(`/$)(^`?)C(`?$)
+    >>> p = Semantics("(^0)data(0$)(^%)(%$)(^?)(?$)(^!)1(!$)AC0SV")
+    >>> p.run()
+    RunResult('halted', steps=6)
+    >>> print(str(p))
+    (^0)(^/)1(/$)(0$)(^%)1(%$)(^?)0(?$)1AC0SV(^!)(!$)
 
-        * I ("input") waits for a line to appear on standard input, then
-          places it (sans newline) in the accumulator.
+    To copy from any arbitrary slot (say 0) to another (say 1), we can say:
 
-        >>> from io import StringIO
-        >>> p = Semantics("(^?)(?$)")
-        >>> p.input = StringIO(chr(10).join(["Line.", "Line!", "LINE!"]))
-        >>> p.execute('I')
-        >>> print(str(p))
-        (^?)Line.(?$)
-        >>> p.execute('I')
-        >>> print(str(p))
-        (^?)Line!(?$)
-        >>> p.execute('I')
-        >>> print(str(p))
-        (^?)LINE!(?$)
-        >>> p.execute('I')
-        >>> print(str(p))
-        (^?)(?$)
+    >>> p = Semantics("(^0)hi(0$)(^1)(1$)(^%)(%$)(^?)(?$)(^!)0(!$)SC1SV")
+    >>> p.run()
+    RunResult('halted', steps=6)
+    >>> print(str(p))
+    (^0)hi(0$)(^1)(^/)hi(/$)(1$)(^%)hi(%$)(^?)1(?$)0SC1SV(^!)(!$)
 
-        * O ("output") outputs the string in the accumulator to standard
-          output, followed by a newline.
+    Accessing a slot with a longer name, such as (^123)xyz(123$), can be
+    done with the help of a free slot like 0:
 
-        >>> p = Semantics("(^?)Hello, world!(?$)")
-        >>> p.execute('O')
-        Hello, world!
-        >>> print(str(p))
-        (^?)Hello, world!(?$)
+    >>> p = Semantics("(^0)(0$)(^123)xyz(123$)(^%)(%$)(^?)(?$)(^!)1(!$)AC0SV2AC0SEV3AC0SEV0SCAVSD")
+    >>> p.run()
+    RunResult('halted', steps=27)
+    >>> print(str(p))
+    (^0)123(0$)(^123)xyz(123$)(^%)123(%$)(^?)(^/)xyz(/$)(?$)1AC0SV2AC0SEV3AC0SEV0SCAVSD(^!)(!$)
 
-        Now we demonstrate some idioms.
+    To write data, say (^8)foo(8$), into a slot whose name is stored in
+    another slot, such as (^9)jim(9$), we can say:
 
-        Assume the inital program defines some slots to contain initial
-        data.  That data can then be loaded into the accumulator:
+    >>> p = Semantics("(^8)foo(8$)(^9)jim(9$)(^jim)(jim$)(^%)(%$)(^?)(?$)(^!)8(!$)SC9SDSV")
+    >>> p.run()
+    RunResult('halted', steps=8)
+    >>> print(str(p))
+    (^8)foo(8$)(^9)jim(9$)(^jim)(^/)foo(/$)(jim$)(^%)foo(%$)(^?)jim(?$)8SC9SDSV(^!)(!$)
 
-        >>> p = Semantics("(^0)data(0$)(^%)(%$)(^?)(?$)(^!)0(!$)SCAV")
-        >>> p.run()
-        >>> print(str(p))
-        (^0)data(0$)(^%)data(%$)(^?)(^/)data(/$)(?$)0SCAV(^!)(!$)
+    Finally, a complete, if simple, program:
 
-        New data, say the literal string 1, can be stored into slot 0 with:
+    >>> p = Semantics("(^?)Hello, world!(?$)(^!)O(!$)")
+    >>> p.run()
+    Hello, world!
+    RunResult('halted', steps=1)
 
-        >>> p = Semantics("(^0)data(0$)(^%)(%$)(^?)(?$)(^!)1(!$)AC0SV")
-        >>> p.run()
+    """
+    OPCODES = {
+        '0': 'op_literal', '1': 'op_literal', '2': 'op_literal',
+        '3': 'op_literal', '4': 'op_literal', '5': 'op_literal',
+        '6': 'op_literal', '7': 'op_literal', '8': 'op_literal',
+        '9': 'op_literal',
+        'X': 'op_cut',
+        'C': 'op_copy',
+        'V': 'op_paste',
+        'S': 'op_select',
+        'A': 'op_select_all',
+        'L': 'op_left',
+        'R': 'op_right',
+        'E': 'op_end',
+        'F': 'op_find',
+        'D': 'op_drag_and_drop',
+        'O': 'op_output',
+        'I': 'op_input',
+    }
+
+    def __init__(self, initial, **kwargs):
+        self.find_cache = None
+        super(Semantics, self).__init__(initial, **kwargs)
+
+    def set(self, string, **kwargs):
+        self.find_cache = None
+        super(Semantics, self).set(string, **kwargs)
+
+    def splice(self, start, end, string):
+        """Replace the characters between the two given positions with
+        the given string, keeping the accumulator contents cached by F
+        up to date: they are shifted if the change is before them, and
+        forgotten if it touches them or the locators around them.
+
+        >>> p = Semantics("(^/)x(/$)(^?)abab(?$)(^%)ba(%$)yz")
+        >>> p.execute('F')
+        >>> p.find_cache[:3]
+        ('?', 5, 17)
+        >>> p.splice(-1, -1, "Q")
+        >>> p.find_cache[:3]
+        ('?', 5, 17)
+        >>> p.splice(-40, 1, "Q")
+        >>> p.find_cache[:3]
+        ('?', 5, 17)
         >>> print(str(p))
-        (^0)(^/)1(/$)(0$)(^%)1(%$)(^?)0(?$)1AC0SV(^!)(!$)
+        Q(^?)a(^/)ba(/$)b(?$)(^%)ba(%$)yQz
 
-        To copy from any arbitrary slot (say 0) to another (say 1), we can say:
+        """
+        cache = self.find_cache
+        if cache is not None:
+            (start, end, string) = self.resolve_splice(start, end, string)
+            (slot_name, a, b) = cache[:3]
+            if end <= a - len(slot_name) - 3:
+                delta = len(string) - (end - start)
+                self.find_cache = (slot_name, a + delta, b + delta) + cache[3:]
+            elif start < b + len(slot_name) + 3:
+                self.find_cache = None
+        return super(Semantics, self).splice(start, end, string)
 
-        >>> p = Semantics("(^0)hi(0$)(^1)(1$)(^%)(%$)(^?)(?$)(^!)0(!$)SC1SV")
-        >>> p.run()
-        >>> print(str(p))
-        (^0)hi(0$)(^1)(^/)hi(/$)(1$)(^%)hi(%$)(^?)1(?$)0SC1SV(^!)(!$)
+    def deselect(self):
+        """Remove the selection locators from this program, if they are
+        in it.
 
-        Accessing a slot with a longer name, such as (^123)xyz(123$), can be
-        done with the help of a free slot like 0:
+        """
+        locator_name = self.get_slot_name('/')
+        for locator in ('(^%s)' % locator_name, '(%s$)' % locator_name):
+            pos = self.find(locator)
+            if pos >= 0:
+                self.splice(pos, pos + len(locator), '')
 
-        >>> p = Semantics("(^0)(0$)(^123)xyz(123$)(^%)(%$)(^?)(?$)(^!)1(!$)AC0SV2AC0SEV3AC0SEV0SCAVSD")
-        >>> p.run()
-        >>> print(str(p))
-        (^0)123(0$)(^123)xyz(123$)(^%)123(%$)(^?)(^/)xyz(/$)(?$)1AC0SV2AC0SEV3AC0SEV0SCAVSD(^!)(!$)
+    def selects(self, slot_name):
+        """Return True if the selection already surrounds the contents of
+        the named slot, so that selecting them would change nothing.
+        Always returns False if shortcuts is false.
 
-        To write data, say (^8)foo(8$), into a slot whose name is stored in
-        another slot, such as (^9)jim(9$), we can say:
+        >>> p = Semantics("(^?)(^/)A(/$)(?$)(^A)Some text.(A$)")
+        >>> p.selects('?'), p.selects('A')
+        (True, False)
 
-        >>> p = Semantics("(^8)foo(8$)(^9)jim(9$)(^jim)(jim$)(^%)(%$)(^?)(?$)(^!)8(!$)SC9SDSV")
-        >>> p.run()
+        """
+        if not self.shortcuts or 'slot-write' in self.hooks:
+            return False
+        locator_name = self.get_slot_name('/')
+        if locator_name == slot_name:
+            return False
+        a = self.find('(^%s)' % slot_name)
+        b = self.find('(%s$)' % slot_name)
+        if a < 0 or b < 0:
+            return False
+        a += len(slot_name) + 3
+        opening = '(^%s)' % locator_name
+        closing = '(%s$)' % locator_name
+        return (self.find(opening) == a and
+                self.find(closing) == b - len(closing) and
+                a + len(opening) <= b - len(closing))
+
+    def select_slot(self, slot_name):
+        """Surround the contents of the named slot with the selection
+        locators.  This is what writing the contents back to the slot,
+        between the locators, would do; but only the locators are
+        inserted, so the contents need not be read or rewritten.
+
+        >>> p = Semantics("(^?)A(?$)(^A)Some text.(A$)")
+        >>> p.select_slot('A')
         >>> print(str(p))
-        (^8)foo(8$)(^9)jim(9$)(^jim)(^/)foo(/$)(jim$)(^%)foo(%$)(^?)jim(?$)8SC9SDSV(^!)(!$)
+        (^?)A(?$)(^A)(^/)Some text.(/$)(A$)
 
-        Finally, a complete, if simple, program:
+        """
+        locator_name = self.get_slot_name('/')
+        opening = '(^%s)' % locator_name
+        closing = '(%s$)' % locator_name
+        a = self.pos_right('(^%s)' % slot_name, 0)
+        b = self.pos_left('(%s$)' % slot_name, 0)
+        if b < a or not self.shortcuts or 'slot-write' in self.hooks:
+            self.update_slot(slot_name, opening + self.store[a:b] + closing)
+            return
+        self.insert_locator(closing, b)
+        self.insert_locator(opening, a)
+
+    def op_literal(self, instruction):
+        self.update_slot(self.get_slot_name('?'), instruction)
+
+    def op_cut(self, instruction):
+        self.update_slot(self.get_slot_name('/'), '')
+
+    def op_copy(self, instruction):
+        self.update_slot(self.get_slot_name('%'), self.read_slot(self.get_slot_name('/')))
+
+    def op_paste(self, instruction):
+        self.update_slot(self.get_slot_name('/'), self.read_slot(self.get_slot_name('%')))
+
+    def op_select(self, instruction):
+        # Unless the selection might be in the accumulator, so that removing
+        # it would change which slot the accumulator names, the slot can
+        # be checked for being selected already.  (The accumulator is not
+        # read with read_slot() here, as that must fail, if it does, only
+        # after the selection is removed.)
+        accumulator = self.get_slot_name('?')
+        a = self.find('(^%s)' % accumulator)
+        b = self.find('(%s$)' % accumulator)
+        if a >= 0 and b >= 0:
+            slot_name = self.store[a + len(accumulator) + 3:b]
+            if '(' not in slot_name and self.selects(slot_name):
+                return
+        self.deselect()
+        self.select_slot(self.read_slot(self.get_slot_name('?')))
+
+    def op_select_all(self, instruction):
+        if self.selects(self.get_slot_name('?')):
+            return
+        self.deselect()
+        self.select_slot(self.get_slot_name('?'))
+
+    def op_left(self, instruction):
+        locator_name = self.get_slot_name('/')
+        self.slide_locator('(^%s)' % locator_name, -1)
 
-        >>> p = Semantics("(^?)Hello, world!(?$)(^!)O(!$)")
-        >>> p.run()
-        Hello, world!
-
-        """
-        if instruction >= '0' and instruction <= '9':
-            self.update_slot(self.get_slot_name('?'), instruction)
-        elif instruction == 'X':
-            self.update_slot(self.get_slot_name('/'), '')
-        elif instruction == 'C':
-            self.update_slot(self.get_slot_name('%'), self.read_slot(self.get_slot_name('/')))
-        elif instruction == 'V':
-            self.update_slot(self.get_slot_name('/'), self.read_slot(self.get_slot_name('%')))
-        elif instruction == 'S':
-            self.deselect()
-            locator_name = self.get_slot_name('/')
-            new_selection = '(^%s)%s(%s$)' % (
-                locator_name,
-                self.read_slot_indirect(self.get_slot_name('?')),
-                locator_name
-            )
-            self.update_slot_indirect(self.get_slot_name('?'), new_selection)
-        elif instruction == 'A':
-            self.deselect()
-            locator_name = self.get_slot_name('/')
-            new_selection = '(^%s)%s(%s$)' % (
-                locator_name,
-                self.read_slot(self.get_slot_name('?')),
-                locator_name
-            )
-            self.update_slot(self.get_slot_name('?'), new_selection)
-        elif instruction == 'L':
-            locator_name = self.get_slot_name('/')
-            self.slide_locator('(^%s)' % locator_name, -1)
-        elif instruction == 'R':
-            locator_name = self.get_slot_name('/')
-            if self.read_slot(locator_name) != '':
-                self.slide_locator('(^%s)' % locator_name, +1)
-        elif instruction == 'E':
-            locator_name = self.get_slot_name('/')
-            self.remove_locator('(^%s)' % locator_name)
-            pos = self.pos_left('(%s$)' % locator_name, 0)
-            self.insert_locator('(^%s)' % locator_name, pos)
-        elif instruction == 'F':
-            accumulator = self.read_slot(self.get_slot_name('?'))
-            clipboard = self.read_slot(self.get_slot_name('%'))
-            pos = accumulator.find(clipboard)
-            if pos >= 0:
-                self.deselect()
-                locator_name = self.get_slot_name('/')
-                accumulator = MutableString(accumulator)
-                accumulator.insert_locator('(^%s)' % locator_name, pos)
-                pos_right = accumulator.pos_right('(^%s)' % locator_name, 0)
-                accumulator.insert_locator('(%s$)' % locator_name,
-                    pos_right + len(clipboard))
-                self.update_slot(self.get_slot_name('?'), accumulator)
-            else:
-                pass
-        elif instruction == 'D':
-            locator_name = self.get_slot_name('/')
-            selection = self.read_slot(locator_name)
+    def op_right(self, instruction):
+        locator_name = self.get_slot_name('/')
+        if self.read_slot(locator_name) != '':
+            self.slide_locator('(^%s)' % locator_name, +1)
+
+    def op_end(self, instruction):
+        locator_name = self.get_slot_name('/')
+        self.remove_locator('(^%s)' % locator_name)
+        pos = self.pos_left('(%s$)' % locator_name, 0)
+        self.insert_locator('(^%s)' % locator_name, pos)
+
+    def op_find(self, instruction):
+        """Select the first occurrence of the clipboard in the accumulator.
+
+        The accumulator is read before the old selection is removed, and
+        written back, with the new selection in it, after; so selection
+        locators which were in the accumulator are put back.  Unless
+        shortcuts is false, instead of rewriting the whole accumulator,
+        the old selection locators which are not in it are removed, and
+        the new ones are inserted in it; and the contents of the
+        accumulator are cached until they change, so that searching them
+        again need not read them out of the program, and so is the
+        position before which the clipboard was last found not to occur
+        in them, so that searching them again for the same thing need not
+        search that part of them again.
+
+        >>> p = Semantics("(^?)a(^/)b(/$)ab(?$)(^%)ab(%$)")
+        >>> p.execute('F')
+        >>> print(str(p))
+        (^?)a(^/)b((/$)/$)(^/)ab(?$)(^%)ab(%$)
+        >>> p = Semantics("(^/)x(/$)(^?)abab(?$)(^%)ba(%$)")
+        >>> p.execute('F')
+        >>> print(str(p))
+        x(^?)a(^/)ba(/$)b(?$)(^%)ba(%$)
+        >>> p.find_cache
+        ('?', 5, 17, 'a(^/)ba(/$)b', 'ba', 0)
+        >>> p.execute('F')
+        >>> print(str(p))
+        x(^?)a(^/)(^(/$)/)ba(/$)b(?$)(^%)ba(%$)
+
+        """
+        slot_name = self.get_slot_name('?')
+        a = self.pos_right(u"(^%s)" % slot_name, 0)
+        b = self.pos_left(u"(%s$)" % slot_name, 0)
+        clipboard = self.read_slot(self.get_slot_name('%'))
+        cache = self.find_cache
+        lower = 0
+        if cache is not None and cache[:3] == (slot_name, a, b):
+            accumulator = cache[3]
+            if cache[4] == clipboard:
+                lower = cache[5]
+        else:
+            accumulator = self.store[a:b]
+        pos = accumulator.find(clipboard, lower)
+        if b < a or not self.shortcuts:
+            # The slot's end comes before its start, so writing to it
+            # repeats text (see splice()); leave that to update_slot().
+            self.find_cache = None
+        elif pos < 0:
+            lower = max(len(accumulator) - len(clipboard) + 1, 0)
+            self.find_cache = (slot_name, a, b, accumulator, clipboard, lower)
+        if pos < 0:
+            return
+        locator_name = self.get_slot_name('/')
+        opening = u"(^%s)" % locator_name
+        closing = u"(%s$)" % locator_name
+        text = accumulator[:pos] + opening + accumulator[pos:]
+        end = min(text.find(opening) + len(opening) + len(clipboard), len(text))
+        text = text[:end] + closing + text[end:]
+        if (b < a or not self.shortcuts or locator_name == slot_name or
+            'slot-write' in self.hooks):
             self.deselect()
-            new_selection = '(^%s)%s(%s$)' % (
-                locator_name,
-                selection,
-                locator_name
-            )
-            self.update_slot(self.get_slot_name('?'), new_selection)
-        elif instruction == 'O':
-            line = self.read_slot('?') + "\n"
-            self.output.write(line)
-        elif instruction == 'I':
-            text = self.input.readline()
-            if text.endswith('\n'):
-                text = text[:-1]
             self.update_slot(self.get_slot_name('?'), text)
-        else:
-            pass
-
-    def step(self):
+            return
+        for locator in (opening, closing):
+            found = self.find(locator)
+            if found >= 0 and not (a <= found and found + len(locator) <= b):
+                self.remove_locator(locator)
+                if found < a:
+                    a -= len(locator)
+                    b -= len(locator)
+        if (self.pos_right(u"(^%s)" % slot_name, 0) != a or
+            self.pos_left(u"(%s$)" % slot_name, 0) != b):
+            self.update_slot(slot_name, text)
+            return
+        self.insert_locator(opening, a + pos)
+        self.insert_locator(closing, a + end)
+        # Nothing before pos has changed, and the clipboard did not occur
+        # there, so it can only occur again at pos, overlapping it, or after.
+        lower = max(pos - len(clipboard) + 1, 0) if clipboard else pos
+        self.find_cache = (slot_name, a, a + len(text), text, clipboard, lower)
+
+    def op_drag_and_drop(self, instruction):
+        if self.selects(self.get_slot_name('?')):
+            return
+        locator_name = self.get_slot_name('/')
+        selection = self.read_slot(locator_name)
+        self.deselect()
+        slot_name = self.get_slot_name('?')
+        if self.shortcuts and self.read_slot(slot_name) == selection:
+            self.select_slot(slot_name)
+            return
+        new_selection = '(^%s)%s(%s$)' % (
+            locator_name,
+            selection,
+            locator_name
+        )
+        self.update_slot(slot_name, new_selection)
+
+    def op_output(self, instruction):
+        line = self.read_slot('?') + "\n"
+        self.output.write(line)
+
+    def op_input(self, instruction):
+        text = self.input.readline()
+        self.input_lines += 1
+        if text.endswith('\n'):
+            text = text[:-1]
+        self.update_slot(self.get_slot_name('?'), text)
+
+    def step(self, limit=None):
         """Execute one step of this Pophery program.
 
         """
-        return super(Semantics, self).step()
+        return super(Semantics, self).step(limit)
 
-    def run(self):
+    def run(self, **kwargs):
         """Execute this Pophery program and return only when it terminates.
 
         """
-        return super(Semantics, self).run()
+        return super(Semantics, self).run(**kwargs)
 
 
 class TracedProgram(Semantics):
@@ -876,35 +3390,856 @@ class TracedProgram(Semantics):
     [(^?)Hello, world!(?$)OO(^!)O(!$)]
     Hello, world!
     [(^?)Hello, world!(?$)OOO(^!)(!$)]
+    RunResult('halted', steps=3)
 
     """
 
-    def __init__(self, initial):
-        super(TracedProgram, self).__init__(initial)
+    def __init__(self, initial, **kwargs):
+        super(TracedProgram, self).__init__(initial, **kwargs)
 
-    def run(self):
+    def run(self, **kwargs):
         print("[%s]" % str(self))
-        super(TracedProgram, self).run()
+        return super(TracedProgram, self).run(**kwargs)
 
-    def step(self):
-        result = super(TracedProgram, self).step()
+    def step(self, limit=None):
+        result = super(TracedProgram, self).step(limit)
         if result:
             print("[%s]" % str(self))
         return result
 
 
+class DeltaTracedProgram(Semantics):
+    """A Program which, once start_trace() has been called, writes a trace
+    of its execution to a file, one JSON value per line.  The first line
+    gives the state of the program when the trace was started.  Each
+    following line gives the number of steps executed so far, the
+    instruction executed by the last step, and the edits that step made,
+    each as a list of the position, the number of characters removed,
+    and the text inserted.  replay() reconstructs the state of the
+    program at any step from such a trace.
+
+    >>> from io import StringIO
+    >>> p = DeltaTracedProgram("(^?)Hi(?$)(^!)O(!$)O")
+    >>> p.start_trace(StringIO())
+    >>> p.run()
+    Hi
+    Hi
+    RunResult('halted', steps=2)
+    >>> print(p.trace_file.getvalue().strip())
+    {"initial":"(^?)Hi(?$)(^!)O(!$)O"}
+    [1,"O",[[15,5,"O(!$)"],[10,5,"O(^!)"]]]
+    [2,"O",[[11,5,"O(^!)"]]]
+
+    """
+
+    def __init__(self, initial, **kwargs):
+        self.trace_file = None
+        self.edits = None
+        super(DeltaTracedProgram, self).__init__(initial, **kwargs)
+
+    def start_trace(self, file):
+        """Start writing a trace of this program's execution to the given
+        open file, beginning with the program's current state.
+
+        """
+        self.trace_file = file
+        self.write_trace({'initial': str(self)})
+
+    def write_trace(self, value):
+        self.trace_file.write(json.dumps(value, separators=(',', ':')) + "\n")
+
+    def set(self, string, **kwargs):
+        if self.trace_file is not None and self.edits is None:
+            self.write_trace([self.steps, None, [[0, len(self), string]]])
+        super(DeltaTracedProgram, self).set(string, **kwargs)
+
+    def splice(self, start, end, string):
+        if self.edits is not None:
+            self.edits.append([start, end - start, string])
+        return super(DeltaTracedProgram, self).splice(start, end, string)
+
+    def step(self, limit=None):
+        if self.trace_file is None:
+            return super(DeltaTracedProgram, self).step(limit)
+        instruction = self.current_instruction()
+        self.edits = []
+        try:
+            result = super(DeltaTracedProgram, self).step(limit)
+            if result:
+                self.write_trace([self.steps, instruction, self.edits])
+        finally:
+            self.edits = None
+        return result
+
+
+class ProfiledProgram(Semantics):
+    """A Program which keeps count of how many times each instruction is
+    executed, and how long executing it, and advancing the instruction
+    slot, take; and samples the length of the program as it runs, after
+    0, 1, 2, 4, 8... steps.  Steps skipped by fast-forwarding are counted
+    and timed together.
+
+    >>> from io import StringIO
+    >>> p = ProfiledProgram("(^?)Hi(?$)(^!)O(!$)xO1")
+    >>> p.output = StringIO()
+    >>> p.run()
+    RunResult('halted', steps=4)
+    >>> profile = p.profile_report()
+    >>> sorted((i, c['count']) for (i, c) in profile['instructions'].items())
+    [('1', 1), ('O', 2), ('x', 1)]
+    >>> profile['advance']['count'], profile['length']
+    (4, {'initial': 22, 'final': 21, 'max': 22, 'samples': [[0, 22], [1, 22], [2, 22], [4, 21]]})
+
+    """
+
+    def __init__(self, initial, **kwargs):
+        super(ProfiledProgram, self).__init__(initial, **kwargs)
+        self.counts = {}
+        self.times = {}
+        self.advance_count = 0
+        self.advance_time = 0.0
+        self.skipped_count = 0
+        self.skipped_time = 0.0
+        self.lengths = []
+        self.next_sample = 0
+
+    def sample_length(self):
+        length = len(self)
+        if self.lengths and self.lengths[-1][0] == self.steps:
+            self.lengths[-1] = [self.steps, length]
+        else:
+            self.lengths.append([self.steps, length])
+
+    def execute(self, instruction):
+        started = time.perf_counter()
+        super(ProfiledProgram, self).execute(instruction)
+        elapsed = time.perf_counter() - started
+        self.counts[instruction] = self.counts.get(instruction, 0) + 1
+        self.times[instruction] = self.times.get(instruction, 0.0) + elapsed
+
+    def advance(self):
+        started = time.perf_counter()
+        super(ProfiledProgram, self).advance()
+        self.advance_time += time.perf_counter() - started
+        self.advance_count += 1
+
+    def skip_noops(self, limit=None):
+        started = time.perf_counter()
+        count = super(ProfiledProgram, self).skip_noops(limit)
+        self.skipped_time += time.perf_counter() - started
+        self.skipped_count += count
+        return count
+
+    def step(self, limit=None):
+        if self.steps >= self.next_sample:
+            self.sample_length()
+            self.next_sample = max(1, self.next_sample * 2)
+        return super(ProfiledProgram, self).step(limit)
+
+    def profile_report(self):
+        """Return the profile of this program's execution so far, as a
+        dictionary which can be written out as JSON.
+
+        """
+        self.sample_length()
+        instructions = {}
+        for (instruction, count) in self.counts.items():
+            total = self.times[instruction]
+            instructions[instruction] = {
+                'count': count, 'total': total, 'mean': total / count,
+            }
+        lengths = [length for (steps, length) in self.lengths]
+        return {
+            'steps': self.steps,
+            'instructions': instructions,
+            'advance': {
+                'count': self.advance_count,
+                'total': self.advance_time,
+                'mean': self.advance_time / max(1, self.advance_count),
+            },
+            'fast_forward': {
+                'count': self.skipped_count,
+                'total': self.skipped_time,
+                'mean': self.skipped_time / max(1, self.skipped_count),
+            },
+            'length': {
+                'initial': lengths[0],
+                'final': lengths[-1],
+                'max': max(lengths),
+                'samples': self.lengths,
+            },
+        }
+
+    def format_profile(self):
+        """Return the profile of this program's execution so far, as a
+        table for people to read.
+
+        """
+        profile = self.profile_report()
+        rows = sorted(profile['instructions'].items(),
+                      key=lambda item: -item[1]['total'])
+        rows.append(('(advance)', profile['advance']))
+        if profile['fast_forward']['count'] > 0:
+            rows.append(('(skipped)', profile['fast_forward']))
+        lines = ["%-12s %10s %12s %12s" %
+                 ('instruction', 'count', 'total (s)', 'mean (us)')]
+        for (name, row) in rows:
+            lines.append("%-12s %10d %12.6f %12.3f" %
+                         (name, row['count'], row['total'], row['mean'] * 1e6))
+        length = profile['length']
+        lines.append("length: %d initially, %d finally, %d at most, over %d steps" %
+                     (length['initial'], length['final'], length['max'],
+                      profile['steps']))
+        lines.append("length after n steps: %s" % ", ".join(
+            ["%d: %d" % (steps, size) for (steps, size) in length['samples']]))
+        return "\n".join(lines)
+
+
+class HeatmappedProgram(Semantics):
+    """A Program which counts how many times the instruction at each
+    position in it is executed, and can render those counts as a heatmap
+    over its text.
+
+    The counts follow the characters they belong to as the program is
+    edited: an edit which only moves locators, such as sliding the
+    instruction slot, leaves every count with its character, and an
+    edit elsewhere in the text shifts the counts after it.  The counts
+    of characters which are replaced are lost.  Steps skipped by
+    fast-forwarding are not counted.
+
+    >>> from io import StringIO
+    >>> p = HeatmappedProgram("(^?)Hi(?$)(^!)O(!$)xO")
+    >>> p.output = StringIO()
+    >>> for steps in (1, 2, 3):
+    ...     result = p.run(max_steps=steps)
+    ...     p.remove_locator("(^!)")
+    ...     p.remove_locator("(!$)")
+    ...     p.insert_locator("(!$)", 11)
+    ...     p.insert_locator("(^!)", 10)
+    >>> sorted(p.heat.items())
+    [(14, 3), (19, 2), (20, 1)]
+    >>> p.update_slot('?', "Hello")
+    >>> sorted(p.heat.items())
+    [(17, 3), (22, 2), (23, 1)]
+    >>> print(p.render_heatmap(width=16))
+    (^?)Hello(?$)(^!
+    <BLANKLINE>
+    )O(!$)xO
+     #    +.
+    >>> p.splice(-1, -1, "zz")
+    >>> sorted(p.heat.items())
+    [(17, 3), (22, 2), (25, 1)]
+    >>> p = HeatmappedProgram("(^!)((!$)")
+    >>> p.run(), p.heat
+    (RunResult('halted', steps=0), {})
+
+    """
+    SHADES = u" .:-=+*#"
+
+    def __init__(self, initial, **kwargs):
+        super(HeatmappedProgram, self).__init__(initial, **kwargs)
+        self.heat = {}
+
+    def text_positions(self, string):
+        """Return the positions of the characters in the given string
+        which are not part of locators.
+
+        """
+        positions = []
+        pos = 0
+        for match in LocatorIndex.LOCATOR.finditer(string):
+            positions.extend(range(pos, match.start()))
+            pos = match.end()
+        positions.extend(range(pos, len(string)))
+        return positions
+
+    def splice(self, start, end, string):
+        (start, end, string) = self.resolve_splice(start, end, string)
+        if self.heat:
+            delta = len(string) - (end - start)
+            old_text = self[start:end]
+            old = self.text_positions(old_text)
+            new = self.text_positions(string)
+            prefix = 0
+            while (prefix < min(len(old), len(new)) and
+                   old_text[old[prefix]] == string[new[prefix]]):
+                prefix += 1
+            suffix = 0
+            while (suffix < min(len(old), len(new)) - prefix and
+                   old_text[old[-1 - suffix]] == string[new[-1 - suffix]]):
+                suffix += 1
+            moved = {}
+            for i in range(len(old)):
+                if i < prefix:
+                    moved[start + old[i]] = start + new[i]
+                elif i >= len(old) - suffix:
+                    moved[start + old[i]] = start + new[i - len(old) + len(new)]
+            heat = {}
+            for (pos, count) in self.heat.items():
+                if pos >= end:
+                    heat[pos + delta] = count
+                elif pos < start:
+                    heat[pos] = count
+                elif pos in moved:
+                    heat[moved[pos]] = count
+            self.heat = heat
+        return super(HeatmappedProgram, self).splice(start, end, string)
+
+    def set(self, string, **kwargs):
+        super(HeatmappedProgram, self).set(string, **kwargs)
+        self.heat = {}
+
+    def step(self, limit=None):
+        slot_name = self.get_slot_name('!')
+        try:
+            pos = self.pos_right(u"(^%s)" % slot_name, 0)
+            end = self.pos_left(u"(%s$)" % slot_name, 0)
+        except UndefinedLocatorError:
+            pos = end = None
+        if pos is not None:
+            while pos < end and self[pos] == u'(':
+                matching = self.find_matching(pos)
+                if matching is None:
+                    # An unmatched parenthesis, so there is no instruction.
+                    pos = end
+                    break
+                pos = matching + 1
+            if pos < end:
+                self.heat[pos] = self.heat.get(pos, 0) + 1
+        return super(HeatmappedProgram, self).step(limit)
+
+    def render_heatmap(self, width=72):
+        """Return the text of this program, broken into lines of the given
+        width, with a line under each showing how often the instruction
+        at each position was executed, on a logarithmic scale from ' '
+        (never) to '#' (as often as the most often executed).
+
+        """
+        string = str(self)
+        hottest = max(self.heat.values() or [1])
+        shades = len(self.SHADES) - 1
+        marks = []
+        for pos in range(len(string)):
+            count = self.heat.get(pos, 0)
+            if count == 0:
+                marks.append(self.SHADES[0])
+            elif hottest == 1:
+                marks.append(self.SHADES[shades])
+            else:
+                level = 1 + int((shades - 1) * math.log(count) /
+                                math.log(hottest) + 0.5)
+                marks.append(self.SHADES[level])
+        lines = []
+        for start in range(0, len(string), width):
+            lines.append(string[start:start + width])
+            lines.append(u''.join(marks[start:start + width]).rstrip())
+        return u"\n".join(lines)
+
+
+class LoopDetectingProgram(Semantics):
+    """A Program which stops running when it comes back to a state it has
+    been in before.  The whole state of a Pophery program is its text, so
+    from a repeated state it can only go round the same loop forever,
+    unless the loop reads input.
+
+    A hash of the text is kept up to date, edit by edit, in a
+    HashedRopeStore which mirrors it, and after each step the hash (and
+    length) of the text is looked up in a table of those seen since the
+    last I instruction.  The table is cleared whenever it holds LOOP_TABLE
+    entries, so a loop longer than that may go unnoticed.  When a loop is
+    found, run() returns a RunResult whose status is LOOP, and loop is set
+    to the step after which the repeated state was first seen and the
+    number of steps the loop takes.
+
+    >>> p = LoopDetectingProgram("(^0)(0$)(^?)!(?$)(^`/)!(`/$)(^%)(%$)"
+    ...                          "(^1)0D(1$)(^!)A(!$)")
+    >>> p.run()
+    RunResult('loop', steps=6)
+    >>> p.loop
+    (3, 3)
+    >>> print(str(p))
+    (^0)(0$)(^?)0(?$)(^`/)!(`/$)(^%)(%$)(^1)0(^!)D(!$)(1$)A
+
+    """
+    LOOP_TABLE = 65536
+
+    def __init__(self, initial, **kwargs):
+        super(LoopDetectingProgram, self).__init__(initial, **kwargs)
+        self.mirror = HashedRopeStore(str(self))
+        self.seen = {}
+        self.loop = None
+
+    def set(self, string, **kwargs):
+        super(LoopDetectingProgram, self).set(string, **kwargs)
+        self.mirror = HashedRopeStore(string)
+        self.seen = {}
+
+    def splice(self, start, end, string):
+        """Replace the characters between the two given positions with
+        the given string, and make the same change to the mirror.
+
+        >>> p = LoopDetectingProgram("(^!)A(!$)BC")
+        >>> p.splice(-2, -1, "xyz")
+        >>> print(str(p.mirror))
+        (^!)A(!$)xyzC
+
+        """
+        (start, end, string) = self.resolve_splice(start, end, string)
+        self.mirror.splice(start, end, string)
+        return super(LoopDetectingProgram, self).splice(start, end, string)
+
+    def state_key(self):
+        return (self.mirror.digest(), len(self.mirror))
+
+    def step(self, limit=None):
+        reads = self.OPCODES.get(self.current_instruction()) == 'op_input'
+        result = super(LoopDetectingProgram, self).step(limit)
+        if reads:
+            self.seen = {}
+        if result:
+            key = self.state_key()
+            first = self.seen.get(key)
+            if first is not None:
+                self.loop = (first, self.steps - first)
+                return False
+            if len(self.seen) >= self.LOOP_TABLE:
+                self.seen = {}
+            self.seen[key] = self.steps
+        return result
+
+    def run(self, **kwargs):
+        self.loop = None
+        self.seen = {self.state_key(): self.steps}
+        result = super(LoopDetectingProgram, self).run(**kwargs)
+        if self.loop is not None:
+            result = RunResult(RunResult.LOOP, result.steps, result.elapsed)
+        return result
+
+
+def replay(file, step=None):
+    """Return the state of a program after the given number of steps, or
+    after all of its steps, as reconstructed from the trace in the given
+    open file, written by a DeltaTracedProgram.
+
+    If the program was fast-forwarded, the trace records a run of steps
+    which were executed together as a single step; the state at the end
+    of such a run is given for any of the steps in it but the last.
+
+    >>> from io import StringIO
+    >>> p = DeltaTracedProgram("(^?)Hi(?$)(^!)OO(!$)")
+    >>> p.start_trace(StringIO())
+    >>> p.output = StringIO()
+    >>> p.run()
+    RunResult('halted', steps=2)
+    >>> for step in (0, 1, None):
+    ...     pos = p.trace_file.seek(0)
+    ...     print(replay(p.trace_file, step))
+    (^?)Hi(?$)(^!)OO(!$)
+    (^?)Hi(?$)O(^!)O(!$)
+    (^?)Hi(?$)OO(^!)(!$)
+
+    """
+    header = json.loads(file.readline())
+    string = MutableString(header['initial'], engine='rope', indexed=False)
+    for line in file:
+        (steps, instruction, edits) = json.loads(line)
+        if step is not None and steps > step:
+            break
+        for (pos, removed, inserted) in edits:
+            string.splice(pos, pos + removed, inserted)
+    return str(string)
+
+
+class Divergence(object):
+    """A difference found by lockstep() between the reference and the
+    candidate runs of a program: after how many steps, in what (one of
+    'state', 'output', 'halt' or 'error'), and what each run had there.
+
+    """
+    def __init__(self, steps, what, reference, candidate):
+        self.steps = steps
+        self.what = what
+        self.reference = reference
+        self.candidate = candidate
+
+    def __repr__(self):
+        return "Divergence(%d, %r)" % (self.steps, self.what)
+
+    def __str__(self):
+        return ("%s differs after %d steps:\n  reference: %s\n  candidate: %s" %
+                (self.what, self.steps, self.reference, self.candidate))
+
+
+def lockstep(text, engine='string', indexed=True, fast_forward=False,
+             every=1, max_steps=None, max_length=None, input=u''):
+    """Run the given program twice, in step with itself: once as the
+    reference, in a plain string with no index, no fast-forwarding, and
+    no shortcuts -- no cached slot names or accumulator, and no selecting
+    in place -- and once as the candidate, with the given engine,
+    indexing, and fast-forwarding.  Compare the states of the two after every every'th
+    step, and their outputs, and whether and how they stopped, and return
+    a Divergence describing the first difference, or None if there was
+    none before both halted, or max_steps steps were executed, or the
+    program grew longer than max_length.  Each run is given the given
+    input.
+
+    Since a fast-forwarded step may execute several steps, the candidate
+    is compared after the first step at or past each every'th step.
+
+    >>> print(lockstep("(^?)Hi(?$)(^!)O(!$) ab O", engine='token', fast_forward=True))
+    None
+    >>> class Broken(StringStore):
+    ...     def find(self, sub, start=0):
+    ...         return self.string.rfind(sub) if sub == u"(^?)" else self.string.find(sub, start)
+    >>> ENGINES['broken'] = Broken
+    >>> d = lockstep("(^?)Hi(?$)(^!)0(!$)O(^?)", engine='broken', indexed=False)
+    >>> del ENGINES['broken']
+    >>> print(d)
+    state differs after 1 steps:
+      reference: (^?)0(?$)0(^!)O(!$)(^?)
+      candidate: (^?)Hi(?$)0(^!)O(!$)(^?)0(?$)(^!)0(!$)O(^?)
+
+    """
+    from io import StringIO
+    reference = Semantics(text, engine='string', indexed=False)
+    reference.shortcuts = False
+    candidate = Semantics(text, engine=engine, indexed=indexed)
+    candidate.fast_forward = fast_forward
+    for program in (reference, candidate):
+        program.input = StringIO(input)
+        program.output = StringIO()
+
+    def step(program):
+        try:
+            return (program.step(), None)
+        except Exception as e:
+            return (False, "%s: %s" % (e.__class__.__name__, e))
+
+    def compare(steps, reference_result, candidate_result):
+        if reference_result != candidate_result:
+            (what, a, b) = ('halt', reference_result[0], candidate_result[0])
+            if reference_result[1] != candidate_result[1]:
+                (what, a, b) = ('error', reference_result[1], candidate_result[1])
+            return Divergence(steps, what, a, b)
+        if reference.output.getvalue() != candidate.output.getvalue():
+            return Divergence(steps, 'output', repr(reference.output.getvalue()),
+                              repr(candidate.output.getvalue()))
+        if str(reference) != str(candidate):
+            return Divergence(steps, 'state', str(reference), str(candidate))
+        return None
+
+    next_check = every
+    while ((max_steps is None or candidate.steps < max_steps) and
+           (max_length is None or len(candidate) <= max_length)):
+        candidate_result = step(candidate)
+        reference_result = (True, None)
+        while reference.steps < candidate.steps and reference_result[0]:
+            reference_result = step(reference)
+        if not candidate_result[0] and reference_result[0]:
+            reference_result = step(reference)
+        if reference.steps != candidate.steps:
+            return Divergence(reference.steps, 'halt', reference_result[0],
+                              candidate_result[0])
+        if not candidate_result[0] or candidate.steps >= next_check:
+            divergence = compare(candidate.steps, reference_result, candidate_result)
+            if divergence is not None or not candidate_result[0]:
+                return divergence
+            while next_check <= candidate.steps:
+                next_check += every
+    return None
+
+
+def run_file(job):
+    """Run the Tranzy file named in the given job, a tuple of (filename,
+    engine, fast_forward, max_steps, timeout, encoding), with empty
+    input, and return a dictionary describing how that went, including
+    everything the program output.  Used by the --jobs batch mode of
+    main().
+
+    >>> import os, tempfile
+    >>> (fd, filename) = tempfile.mkstemp()
+    >>> f = os.fdopen(fd, 'w')
+    >>> n = f.write(chr(10).join(["# encoding: UTF-8", "(^?)Hi(?$)(^!)O(!$)OO"]))
+    >>> f.close()
+    >>> summary = run_file((filename, 'string', False, 2, None, None))
+    >>> print(summary['status'], summary['steps'], repr(summary['output']))
+    step-limit 2 'Hi\\nHi\\n'
+    >>> summary = run_file((filename + '.missing', 'string', False, None, None, None))
+    >>> print(summary['status'], summary['steps'], summary['error'][:17])
+    error 0 FileNotFoundError
+    >>> os.unlink(filename)
+
+    """
+    from io import StringIO
+    (filename, engine, fast_forward, max_steps, timeout, encoding) = job
+    started = time.time()
+    summary = {'file': filename, 'steps': 0}
+    program = Semantics('', engine=engine)
+    program.input = StringIO()
+    program.output = StringIO()
+    program.fast_forward = fast_forward
+    try:
+        program.load_compiled(filename, encoding=encoding)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        result = program.run(max_steps=max_steps, deadline=deadline)
+        summary['status'] = result.status
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = "%s: %s" % (e.__class__.__name__, e)
+    summary['steps'] = program.steps
+    summary['elapsed'] = time.time() - started
+    summary['output'] = program.output.getvalue()
+    return summary
+
+
+class SocketOutput(object):
+    """File-like object which sends each string written to it down the
+    given socket, as a JSON line of the form {"output": string}.
+
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, string):
+        self.conn.sendall(json.dumps({'output': string}).encode('utf-8') + b'\n')
+
+
+def serve_connection(conn, engine='string', fast_forward=False,
+                     max_steps=None, timeout=None):
+    """Serve one request on the given connected socket.
+
+    The request is a JSON line giving the "program" to run and,
+    optionally, its "input" (a string), and "max_steps" and "timeout"
+    limits, which may only be tighter than those given here.  The program
+    is run, and what it outputs is sent back as it is output, as JSON
+    lines of the form {"output": string}; then a last JSON line is sent,
+    giving the "status" the program stopped with (or "error"), the
+    "steps" it executed, its final "state", and the "elapsed" time.
+
+    >>> import socket
+    >>> (server, client) = socket.socketpair()
+    >>> client.sendall(json.dumps({'program': "(^?)(?$)(^!)I(!$)OO",
+    ...                            'input': "hi", 'max_steps': 2}).encode('utf-8') + b'\\n')
+    >>> serve_connection(server)
+    >>> server.close()
+    >>> for line in client.makefile('rb'):
+    ...     reply = json.loads(line)
+    ...     print(sorted((k, v) for (k, v) in reply.items() if k != 'elapsed'))
+    [('output', 'hi\\n')]
+    [('state', '(^?)hi(?$)IO(^!)O(!$)'), ('status', 'step-limit'), ('steps', 2)]
+
+    """
+    from io import StringIO
+    started = time.time()
+    reply = {'steps': 0}
+    try:
+        request = json.loads(conn.makefile('rb').readline().decode('utf-8'))
+        limits = []
+        for (limit, given) in ((max_steps, request.get('max_steps')),
+                               (timeout, request.get('timeout'))):
+            limits.append(min([x for x in (limit, given) if x is not None] or [None]))
+        (steps_limit, time_limit) = limits
+        program = Semantics(request['program'], engine=engine)
+        program.fast_forward = fast_forward
+        program.input = StringIO(request.get('input', u''))
+        program.output = SocketOutput(conn)
+        deadline = None
+        if time_limit is not None:
+            deadline = time.time() + time_limit
+        try:
+            result = program.run(max_steps=steps_limit, deadline=deadline)
+            reply['status'] = result.status
+        finally:
+            reply['steps'] = program.steps
+            reply['state'] = str(program)
+    except Exception as e:
+        reply['status'] = 'error'
+        reply['error'] = "%s: %s" % (e.__class__.__name__, e)
+    reply['elapsed'] = time.time() - started
+    try:
+        conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+    except socket.error:
+        pass
+
+
+def serve(path, workers=4, **kwargs):
+    """Listen on a Unix domain socket at the given path, and serve requests
+    on it, as serve_connection() does, in the given number of worker
+    processes, forked in advance, until interrupted or terminated.  A
+    worker which exits is replaced by a new one.
+
+    A socket left at path by an earlier server is removed first, but if
+    something other than a socket is there, ValueError is raised.
+
+    """
+    import signal
+    import stat
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        mode = None
+    if mode is not None:
+        if not stat.S_ISSOCK(mode):
+            raise ValueError("%s: exists and is not a socket" % path)
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    children = []
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                while True:
+                    (conn, address) = listener.accept()
+                    try:
+                        serve_connection(conn, **kwargs)
+                    finally:
+                        conn.close()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    try:
+        for i in range(workers):
+            fork_worker()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        while children:
+            (pid, status) = os.wait()
+            if pid in children:
+                children.remove(pid)
+                fork_worker()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        listener.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
 
 def main(argv):
     optparser = OptionParser("[python] %prog {options} {source.tranzy}\n" + __doc__)
+    optparser.add_option("-c", "--compile",
+                         action="store_true", dest="compile", default=False,
+                         help="write a snapshot of each Tranzy file, which "
+                              "later runs of it will load instead while it "
+                              "is up to date, and exit")
+    optparser.add_option("--checkpoint",
+                         action="store", type="string", dest="checkpoint", default=None,
+                         help="write the state of the running program to this "
+                              "file periodically, and when it stops")
+    optparser.add_option("--checkpoint-every",
+                         action="store", type="float", dest="checkpoint_every",
+                         default=Program.CHECKPOINT_EVERY,
+                         help="with --checkpoint, write a checkpoint after "
+                              "every this many seconds (default: %s)" %
+                              Program.CHECKPOINT_EVERY)
+    optparser.add_option("-d", "--delta-trace",
+                         action="store", type="string", dest="delta_trace", default=None,
+                         help="write a trace of the edits made by each step "
+                              "of execution to this file")
+    optparser.add_option("--detect-loops",
+                         action="store_true", dest="detect_loops", default=False,
+                         help="stop each program when it returns to a state it "
+                              "has been in before, without reading input in "
+                              "between, and report the loop")
     optparser.add_option("-e", "--evaluate",
                          action="store", type="string", dest="program", default=None,
                          help="evaluate Pophery program on command line")
+    optparser.add_option("-E", "--engine",
+                         action="store", type="choice", dest="engine",
+                         choices=sorted(ENGINES.keys()), default='string',
+                         help="backing store to keep the program in "
+                              "(one of: %s; default: string)" %
+                              ", ".join(sorted(ENGINES.keys())))
+    optparser.add_option("--encoding",
+                         action="store", type="string", dest="encoding", default=None,
+                         help="character encoding of the Tranzy files "
+                              "(default: as given in the file, or UTF-8)")
+    optparser.add_option("-f", "--fast-forward",
+                         action="store_true", dest="fast_forward", default=False,
+                         help="skip over runs of characters which are not "
+                              "instructions in a single step")
+    optparser.add_option("--lockstep",
+                         action="store_true", dest="lockstep", default=False,
+                         help="instead of running each program, run it in the "
+                              "chosen engine and in a plain string in step, "
+                              "with empty input, and report the first "
+                              "difference between the two")
+    optparser.add_option("--lockstep-every",
+                         action="store", type="int", dest="lockstep_every", default=1,
+                         help="with --lockstep, compare the two runs after "
+                              "every this many steps (default: 1)")
+    optparser.add_option("-m", "--max-steps",
+                         action="store", type="int", dest="max_steps", default=None,
+                         help="stop each program after executing this many steps")
+    optparser.add_option("--flush-every",
+                         action="store", type="int", dest="flush_every", default=None,
+                         help="buffer output, writing it out after every this "
+                              "many lines")
+    optparser.add_option("--heatmap",
+                         action="store_true", dest="heatmap", default=False,
+                         help="show how often the instruction at each position "
+                              "of the program was executed, on standard error")
+    optparser.add_option("--input-buffer",
+                         action="store", type="int", dest="input_buffer", default=None,
+                         help="read input ahead, up to this many bytes at a time")
+    optparser.add_option("-j", "--jobs",
+                         action="store", type="int", dest="jobs", default=None,
+                         help="run the given Tranzy files in this many worker "
+                              "processes, printing a JSON summary line for "
+                              "each instead of its output")
     optparser.add_option("-l", "--show-license",
                          action="store_true", dest="show_license", default=False,
                          help="show product license and exit")
+    optparser.add_option("--output-buffer",
+                         action="store", type="int", dest="output_buffer", default=None,
+                         help="buffer output, writing it out whenever this many "
+                              "characters have collected (default with "
+                              "--flush-every: 65536)")
+    optparser.add_option("-p", "--profile",
+                         action="store_true", dest="profile", default=False,
+                         help="report how often each instruction was executed "
+                              "and how long it took, on standard error")
+    optparser.add_option("--profile-json",
+                         action="store", type="string", dest="profile_json", default=None,
+                         help="write the report made by --profile to this "
+                              "file, as JSON")
+    optparser.add_option("--replay",
+                         action="store", type="string", dest="replay", default=None,
+                         help="print the state of the program traced in this "
+                              "file by --delta-trace, and exit")
+    optparser.add_option("--replay-step",
+                         action="store", type="int", dest="replay_step", default=None,
+                         help="with --replay, print the state after this many "
+                              "steps (default: after the last step)")
+    optparser.add_option("--resume",
+                         action="store_true", dest="resume", default=False,
+                         help="with --checkpoint, continue from the state "
+                              "written to that file, if there is one, giving "
+                              "it the same input as before")
+    optparser.add_option("--serve",
+                         action="store", type="string", dest="serve", default=None,
+                         help="listen on a Unix domain socket at this path for "
+                              "JSON requests to run programs, in --jobs worker "
+                              "processes (default: 4), until interrupted")
     optparser.add_option("-t", "--trace",
                          action="store_true", dest="trace", default=False,
                          help="trace execution during run")
+    optparser.add_option("--timeout",
+                         action="store", type="float", dest="timeout", default=None,
+                         help="stop each program after running for this many "
+                              "seconds")
     optparser.add_option("-T", "--run-tests",
                          action="store_true", dest="run_tests", default=False,
                          help="run self-tests and exit")
@@ -927,17 +4262,148 @@ def main(argv):
     if exit_code is not None:
         sys.exit(exit_code)
 
-    klass = Semantics
-    if options.trace:
-        klass = TracedProgram
+    if options.compile:
+        for filename in args:
+            program = Program('', engine=options.engine)
+            program.load(filename, encoding=options.encoding)
+            program.save_snapshot(filename + Program.SNAPSHOT_SUFFIX,
+                                  source=filename)
+        sys.exit(0)
+
+    if options.lockstep:
+        sources = [('<command line>', options.program)] if options.program else []
+        for filename in args:
+            program = Program('', indexed=False)
+            program.load(filename, encoding=options.encoding)
+            sources.append((filename, str(program)))
+        exit_code = 0
+        for (name, text) in sources:
+            divergence = lockstep(text, engine=options.engine,
+                                  fast_forward=options.fast_forward,
+                                  every=options.lockstep_every,
+                                  max_steps=options.max_steps)
+            if divergence is None:
+                print("%s: no divergence" % name)
+            else:
+                print("%s: %s" % (name, divergence))
+                exit_code = 1
+        sys.exit(exit_code)
+
+    if options.serve is not None:
+        try:
+            serve(options.serve, workers=options.jobs or 4,
+                  engine=options.engine, fast_forward=options.fast_forward,
+                  max_steps=options.max_steps, timeout=options.timeout)
+        except ValueError as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+        sys.exit(0)
+
+    if options.jobs is not None:
+        import multiprocessing
+        jobs = [(filename, options.engine, options.fast_forward,
+                 options.max_steps, options.timeout, options.encoding)
+                for filename in args]
+        pool = multiprocessing.Pool(options.jobs)
+        exit_code = 0
+        try:
+            for summary in pool.imap(run_file, jobs):
+                print(json.dumps(summary, sort_keys=True))
+                sys.stdout.flush()
+                if summary['status'] != RunResult.HALTED:
+                    exit_code = 1
+        finally:
+            pool.close()
+            pool.join()
+        sys.exit(exit_code)
 
+    if options.replay is not None:
+        file = open(options.replay, 'r')
+        try:
+            print(replay(file, options.replay_step))
+        finally:
+            file.close()
+        sys.exit(0)
+
+    classes = []
+    if options.trace:
+        classes.append(TracedProgram)
+    if options.delta_trace is not None:
+        classes.append(DeltaTracedProgram)
+    profile = options.profile or options.profile_json is not None
+    if profile:
+        classes.append(ProfiledProgram)
+    if options.heatmap:
+        classes.append(HeatmappedProgram)
+    if options.detect_loops:
+        classes.append(LoopDetectingProgram)
+    if len(classes) == 0:
+        klass = Semantics
+    elif len(classes) == 1:
+        klass = classes[0]
+    else:
+        klass = type('Program', tuple(classes), {})
+
+    def run(program, name):
+        program.fast_forward = options.fast_forward
+        if options.output_buffer is not None or options.flush_every is not None:
+            program.output = BufferedOutput(sys.stdout,
+                                            size=options.output_buffer or 65536,
+                                            lines=options.flush_every)
+        if options.input_buffer is not None:
+            program.input = BufferedInput(getattr(sys.stdin, 'buffer', sys.stdin),
+                                          size=options.input_buffer)
+        if options.checkpoint is not None:
+            program.checkpoint = options.checkpoint
+            program.checkpoint_every = options.checkpoint_every
+            if options.resume and os.path.exists(options.checkpoint):
+                if not program.resume(options.checkpoint):
+                    sys.stderr.write("%s: not a usable checkpoint\n" %
+                                     options.checkpoint)
+                    sys.exit(1)
+        if options.delta_trace is not None:
+            program.start_trace(open(options.delta_trace, 'w'))
+        deadline = None
+        if options.timeout is not None:
+            deadline = time.time() + options.timeout
+        try:
+            result = program.run(max_steps=options.max_steps, deadline=deadline)
+        finally:
+            if options.delta_trace is not None:
+                program.trace_file.close()
+        if not result.halted:
+            sys.stderr.write("%s: stopped after %d steps (%s)\n" %
+                             (name, result.steps, result.status))
+        if result.status == RunResult.LOOP:
+            (first, length) = program.loop
+            sys.stderr.write("%s: the state after step %d repeats the state "
+                             "after step %d, in a loop of %d steps\n" %
+                             (name, program.steps, first, length))
+        if options.profile:
+            sys.stderr.write("%s:\n%s\n" % (name, program.format_profile()))
+        if options.heatmap:
+            sys.stderr.write("%s:\n%s\n" % (name, program.render_heatmap()))
+        if options.profile_json is not None:
+            file = open(options.profile_json, 'w')
+            try:
+                json.dump(program.profile_report(), file, sort_keys=True)
+            finally:
+                file.close()
+        return result.halted
+
+    exit_code = 0
     if options.program is not None:
-        klass(options.program).run()
+        program = klass(options.program, engine=options.engine)
+        if not run(program, '<command line>'):
+            exit_code = 1
 
     for filename in args:
-        program = klass('')
-        program.load(filename)
-        program.run()
+        program = klass('', engine=options.engine)
+        program.load_compiled(filename, encoding=options.encoding)
+        if not run(program, filename):
+            exit_code = 1
+
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,3 @@
 #!/bin/sh
 
-src/pophery.py -T
+src/pophery.py -T && src/benchmark.py -T && src/microbench.py -T && src/fuzz.py -T